@@ -0,0 +1,65 @@
+# row -> bulk document 변환 micro benchmark
+# 기존 per-field loop 방식과 compileBulkConverter 를 비교
+#   python3 bench_converter.py [rows] [columns]
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-2')
+
+import lambda_function
+
+lambda_function.log = lambda messge = '': None
+
+
+def legacyConvert(_config, fields = []):
+    # compileBulkConverter 이전 makeBulkJsonAndAddQueue 의 변환 부분
+    if (len(fields) != len(_config['indexFieldNames'])):
+        raise Exception('[fieldsValidate] fieldCount Not Equals Headers')
+
+    header = {'index': {'_index': _config['realIndex'], '_id': fields[0]}}
+    body = {}
+
+    for fieldSeq in range(len(fields)):
+        fieldName = _config['indexFieldNames'][fieldSeq]
+        if _config['fieldArrayDelimiter'] != '' and _config['fieldArrayDelimiter'] in fields[fieldSeq]:
+            body[fieldName] = fields[fieldSeq].split(_config['fieldArrayDelimiter'])
+        else:
+            body[fieldName] = fields[fieldSeq]
+
+    return json.dumps(header), body
+
+
+def main():
+    rowCount = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    columnCount = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    fieldNames = ['field' + str(seq) for seq in range(columnCount)]
+    rows = [[str(rowSeq)] + [f'value{rowSeq}-{seq}' if seq % 5 else 'a|b|c' for seq in range(1, columnCount)] for rowSeq in range(rowCount)]
+
+    job = lambda_function.IndexingJob()
+    job.config.update({
+        'action': 'create',
+        'alias': 'bench',
+        'realIndex': 'bench-20210101000000',
+        'fieldArrayDelimiter': '|',
+        'indexFieldNames': fieldNames
+    })
+    job.compileBulkConverter()
+    convert = job.bulkConverter['convert']
+
+    assert [legacyConvert(job.config, row)[1] for row in rows[:100]] == [convert(row)[1] for row in rows[:100]]
+
+    legacySeconds = min(timeit.repeat(lambda: [legacyConvert(job.config, row) for row in rows], number=1, repeat=3))
+    compiledSeconds = min(timeit.repeat(lambda: [convert(row) for row in rows], number=1, repeat=3))
+
+    print(f'rows : {rowCount}, columns : {columnCount}')
+    print(f'legacy   : {legacySeconds:.3f}s, {rowCount / legacySeconds:,.0f} rows/s')
+    print(f'compiled : {compiledSeconds:.3f}s, {rowCount / compiledSeconds:,.0f} rows/s')
+    print(f'speedup  : {legacySeconds / compiledSeconds:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
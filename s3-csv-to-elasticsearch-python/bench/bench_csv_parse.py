@@ -0,0 +1,73 @@
+# csv parse micro benchmark
+# 기존 line 단위 decode + split, block decode + split, block decode + csv 모듈 (fileQuoteChar) 비교
+#   python3 bench_csv_parse.py [rows] [columns]
+import io
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-2')
+
+import lambda_function
+
+lambda_function.log = lambda messge = '': None
+
+
+def legacyRecords(data, delimiter = ','):
+    # readS3ObjectRecords 이전 bulk() 의 line 단위 decode + split
+    remainder = b''
+    streamingBody = io.BytesIO(data)
+    while True:
+        chunk = streamingBody.read(lambda_function._s3Stream['chunkSize'])
+        if not chunk:
+            break
+
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+
+        for line in lines:
+            yield line.rstrip(b'\r').decode('utf-8').split(delimiter)
+
+    if remainder != b'':
+        yield remainder.decode('utf-8').split(delimiter)
+
+
+def countRecords(records):
+    count = 0
+    for fields in records:
+        count = count + 1
+    return count
+
+
+def main():
+    rowCount = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    columnCount = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    lines = [','.join(['field' + str(seq) for seq in range(columnCount)])]
+    for rowSeq in range(rowCount):
+        lines.append(','.join([str(rowSeq)] + [f'value{rowSeq}-{seq}' if seq % 7 else '한글값' for seq in range(1, columnCount)]))
+    data = ('\n'.join(lines) + '\n').encode('utf-8')
+    megaBytes = len(data) / 1024 / 1024
+
+    job = lambda_function.IndexingJob()
+
+    def newRecords(quoteChar):
+        job.config.update({'fileFieldDelimiter': ',', 'fileQuoteChar': quoteChar})
+        return job.readS3ObjectRecords(io.BytesIO(data), lambda_function.makeStreamPosition())
+
+    cases = [
+        ('legacy line split', lambda: countRecords(legacyRecords(data))),
+        ('block split', lambda: countRecords(newRecords(''))),
+        ('block csv', lambda: countRecords(newRecords('"')))
+    ]
+
+    print(f'rows : {rowCount}, columns : {columnCount}, size : {megaBytes:.1f}MB')
+    for name, case in cases:
+        assert case() == rowCount + 1
+        seconds = min(timeit.repeat(case, number=1, repeat=3))
+        print(f'{name:18} : {seconds:.3f}s, {rowCount / seconds:,.0f} rows/s, {megaBytes / seconds:.1f}MB/s')
+
+
+if __name__ == '__main__':
+    main()
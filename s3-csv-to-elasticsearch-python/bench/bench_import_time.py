@@ -0,0 +1,53 @@
+# lambda_function cold start import time benchmark (python -X importtime)
+#   python3 bench_import_time.py [repeat]
+import os
+import statistics
+import subprocess
+import sys
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+
+def runPython(arguments = []):
+    # 새 process 에서 실행해야 module cache 없이 cold start 와 같은 조건
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-2')
+    return subprocess.run([sys.executable] + arguments, cwd=SRC_PATH, env=env, capture_output=True, text=True, check=True)
+
+
+def runImportTime(code = ''):
+    completed = runPython(['-X', 'importtime', '-c', code])
+
+    # import time:  self [us] | cumulative | imported package
+    modules = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        selfTime, cumulativeTime, name = line[len('import time:'):].split('|')
+        modules.append((name.rstrip(), int(selfTime), int(cumulativeTime)))
+
+    return modules
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    importTimes = []
+    for seq in range(repeat):
+        modules = runImportTime('import lambda_function')
+        importTimes.append([cumulativeTime for name, selfTime, cumulativeTime in modules if name.strip() == 'lambda_function'][0])
+
+    # 처음 S3, elasticsearch 요청 시 생성되는 client 까지 포함한 시간 (첫 invocation 에서 지불)
+    firstUseCode = 'import time; startTime = time.perf_counter(); import lambda_function; lambda_function.log = lambda messge = "": None; ' \
+        + 'lambda_function.getS3Client(); lambda_function.getHttpSession(); print(int((time.perf_counter() - startTime) * 1000000))'
+    firstUseTime = statistics.median([int(runPython(['-c', firstUseCode]).stdout) for seq in range(repeat)])
+
+    print(f'import lambda_function : median {statistics.median(importTimes) / 1000:.1f}ms, min {min(importTimes) / 1000:.1f}ms ({repeat} runs)')
+    print(f'import + first s3, http client : median {firstUseTime / 1000:.1f}ms')
+    print('heaviest modules at import :')
+    for name, selfTime, cumulativeTime in sorted(modules, key=lambda module: module[1], reverse=True)[:10]:
+        print(f'  {selfTime / 1000:8.1f}ms  {name.strip()}')
+
+
+if __name__ == '__main__':
+    main()
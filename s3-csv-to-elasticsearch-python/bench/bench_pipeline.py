@@ -0,0 +1,385 @@
+# lambda_handler 전체 (S3 읽기 -> parse -> _bulk -> alias 교체) throughput benchmark
+# AWS, Elasticsearch 없이 local S3 대역과 fake Elasticsearch http server 로 실행 (offline)
+#   python3 bench_pipeline.py                                   # 기본 case 들
+#   python3 bench_pipeline.py --rows 100000 --columns 20 --array-columns 2 --latency 0.02 --reject-rate 0.01
+#   python3 bench_pipeline.py --duplicate-rate 0.5 --dedup --dedup-max-memory-keys 100000   # dedup memory / throughput
+#   python3 bench_pipeline.py --jobs 4                          # alias 4 개 파일을 한 event 로, 같은 process 에서 동시에 색인
+#   python3 bench_pipeline.py --compression gz                  # case 마다 압축하지 않은 파일과 .csv.gz 파일을 이어서 실행
+import argparse
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-2')
+
+_defaultCases = [
+    {'name': 'narrow', 'rows': 200000, 'columns': 5, 'arrayColumns': 0},
+    {'name': 'wide', 'rows': 50000, 'columns': 50, 'arrayColumns': 0},
+    {'name': 'array', 'rows': 100000, 'columns': 10, 'arrayColumns': 3},
+    {'name': 'quoted', 'rows': 100000, 'columns': 10, 'arrayColumns': 0, 'quoteChar': '"'}
+]
+
+_bucket = 'bench-bucket'
+_alias = 'bench'
+
+
+###########################################################################
+# synthetic csv
+###########################################################################
+def makeCsv(rowCount, columnCount, arrayColumnCount = 0, quoteChar = '', duplicateRate = 0.0, seed = 0):
+    # 첫 컬럼은 _id, 마지막 arrayColumnCount 개 컬럼은 '|' 로 구분된 배열 값
+    # duplicateRate 비율의 row 는 앞의 row 와 같은 _id (정정 데이터를 덧붙이는 producer)
+    generator = random.Random(seed)
+    fieldNames = ['id'] + [f'field{seq}' for seq in range(1, columnCount)]
+    arrayFieldNames = fieldNames[columnCount - arrayColumnCount:] if arrayColumnCount > 0 else []
+
+    # 생성 중 memory 가 peak RSS 에 섞이지 않도록 line 을 바로 byte buffer 에 씀
+    data = bytearray((','.join(fieldNames) + '\n').encode('utf-8'))
+    for rowSeq in range(rowCount):
+        fields = [str(generator.randrange(rowSeq) if rowSeq > 0 and generator.random() < duplicateRate else rowSeq)]
+        for seq in range(1, columnCount):
+            if fieldNames[seq] in arrayFieldNames:
+                fields.append('|'.join(f'tag{generator.randrange(1000)}' for count in range(generator.randrange(1, 5))))
+            elif seq % 5 == 0:
+                fields.append('한글 값 ' + str(generator.randrange(100000)))
+            else:
+                fields.append(f'value{generator.randrange(1000000)}')
+
+        if quoteChar != '':
+            fields = [fields[0]] + [quoteChar + field + ', x' + quoteChar for field in fields[1:]]
+        data += (','.join(fields) + '\n').encode('utf-8')
+
+    return data, fieldNames, arrayFieldNames
+
+
+def compressCsv(data, compression = ''):
+    # S3 key 의 확장자 (.csv.gz, .csv.bz2, .csv.zst) 에 맞게 압축, zst 는 zstandard module 필요
+    if compression == 'gz':
+        return gzip.compress(data, compresslevel=6)
+    if compression == 'bz2':
+        import bz2
+        return bz2.compress(data)
+    if compression == 'zst':
+        import zstandard
+        return zstandard.ZstdCompressor().compress(data)
+
+    return data
+
+
+###########################################################################
+# local S3
+###########################################################################
+class LocalS3ClientError(Exception):
+    def __init__(self, code = ''):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class LocalS3NoSuchKey(LocalS3ClientError):
+    def __init__(self):
+        super().__init__('NoSuchKey')
+
+
+class LocalS3Body:
+    # 큰 object 를 복사하지 않고 읽는 StreamingBody 대역
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def read(self, size = -1):
+        end = len(self.data) if size is None or size < 0 else min(len(self.data), self.offset + size)
+        chunk = bytes(self.data[self.offset:end])
+        self.offset = end
+        return chunk
+
+    def close(self):
+        self.data.release()
+
+
+class LocalS3:
+    # lambda_function 이 사용하는 boto3 S3 client 의 method 만 memory 위에 구현
+    class exceptions:
+        ClientError = LocalS3ClientError
+        NoSuchKey = LocalS3NoSuchKey
+
+    def __init__(self):
+        self.objects = {}
+
+    def makeETag(self, key):
+        return '"' + str(id(self.objects[key])) + '"'
+
+    def head_object(self, Bucket, Key, **kwargs):
+        if Key not in self.objects:
+            raise LocalS3NoSuchKey()
+        return {'ETag': self.makeETag(Key), 'ContentLength': len(self.objects[Key])}
+
+    def get_object(self, Bucket, Key, Range = None, IfNoneMatch = None, **kwargs):
+        if Key not in self.objects:
+            raise LocalS3NoSuchKey()
+        if IfNoneMatch is not None and IfNoneMatch == self.makeETag(Key):
+            raise LocalS3ClientError('304')
+
+        data = memoryview(self.objects[Key])
+        if Range is not None:
+            start, end = Range[len('bytes='):].split('-')
+            data = data[int(start):(int(end) + 1 if end != '' else None)]
+
+        return {'Body': LocalS3Body(data), 'ETag': self.makeETag(Key), 'ContentLength': len(data)}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        self.objects[Key] = Body.encode('utf-8') if isinstance(Body, str) else Body
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self.objects[Key] = self.objects[CopySource['Key']]
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.objects.pop(Key, None)
+
+
+###########################################################################
+# fake Elasticsearch
+###########################################################################
+class FakeElasticsearchHandler(BaseHTTPRequestHandler):
+    # _bulk 는 latency 만큼 기다린 후 rejectRate 비율의 item 을 429 로 거절, 나머지 API 는 성공 응답
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    rejectRate = 0.0
+    stats = {'bulkCount': 0, 'indexedCount': 0, 'rejectedCount': 0, 'lock': threading.Lock()}
+
+    def log_message(self, *args):
+        pass
+
+    def readBody(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    def reply(self, result, status = 200):
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.readBody()
+        if self.path.startswith('/_bulk'):
+            return self.reply(self.bulk(body))
+        return self.reply({'acknowledged': True})
+
+    def do_PUT(self):
+        self.readBody()
+        self.reply({'acknowledged': True})
+
+    def do_DELETE(self):
+        self.reply({'acknowledged': True})
+
+    def do_GET(self):
+        if self.path.startswith('/_cluster/health'):
+            return self.reply({'status': 'green', 'timed_out': False})
+        # _cat/aliases, _cat/indices : 기존 index 없음
+        return self.reply([])
+
+    def bulk(self, body):
+        time.sleep(self.latency * random.uniform(0.5, 1.5))
+
+        lines = body.split(b'\n')
+        items = []
+        seq = 0
+        while seq < len(lines) and lines[seq] != b'':
+            action = next(iter(json.loads(lines[seq])))
+            seq = seq + (1 if action == 'delete' else 2)
+
+            if random.random() < self.rejectRate:
+                items.append({action: {'status': 429, 'error': {'type': 'es_rejected_execution_exception'}}})
+            else:
+                items.append({action: {'status': 201}})
+
+        rejectedCount = sum(1 for item in items if 'error' in next(iter(item.values())))
+        with self.stats['lock']:
+            self.stats['bulkCount'] = self.stats['bulkCount'] + 1
+            self.stats['indexedCount'] = self.stats['indexedCount'] + len(items) - rejectedCount
+            self.stats['rejectedCount'] = self.stats['rejectedCount'] + rejectedCount
+
+        return {'errors': rejectedCount > 0, 'items': items}
+
+
+###########################################################################
+# benchmark
+###########################################################################
+def getPeakRssKilobytes():
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measureJobStateBytes(count = 1000):
+    # 색인 전 IndexingJob 하나가 차지하는 memory (config, queue, 통계 dict 와 lock)
+    import tracemalloc
+    import lambda_function
+
+    tracemalloc.start()
+    startBytes = tracemalloc.get_traced_memory()[0]
+    jobs = [lambda_function.IndexingJob() for seq in range(count)]
+    jobBytes = (tracemalloc.get_traced_memory()[0] - startBytes) // count
+    tracemalloc.stop()
+    del jobs
+
+    return jobBytes
+
+
+def runCase(case, options, resultQueue):
+    # case 마다 새 process (spawn) 에서 실행해서 peak memory 가 이전 case 의 영향을 받지 않도록
+    import lambda_function
+    lambda_function.log = lambda messge = '': None
+
+    FakeElasticsearchHandler.latency = options['latency']
+    FakeElasticsearchHandler.rejectRate = options['rejectRate']
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeElasticsearchHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    data, fieldNames, arrayFieldNames = makeCsv(case['rows'], case['columns'], case['arrayColumns'], case.get('quoteChar', ''), options['duplicateRate'])
+    compression = case.get('compression', '')
+    # MB, MB/s 는 압축 전 csv 크기 기준이라 압축하지 않은 case 와 비교할 수 있음
+    fileBytes = len(data) * options['jobs']
+    data = compressCsv(data, compression)
+    config = {
+        'fileFieldDelimiter': ',',
+        'fileQuoteChar': case.get('quoteChar', ''),
+        'fieldArrayDelimiter': '|',
+        'arrayFieldNames': arrayFieldNames,
+        'indexMappings': {'mappings': {'properties': {fieldName: {'type': 'keyword'} for fieldName in fieldNames}}},
+        'bulkQueue': {'gzipLevel': options['gzipLevel']},
+        'dedup': {'enable': options['dedup'], 'maxMemoryKeys': options['dedupMaxMemoryKeys']}
+    }
+
+    # jobs 개의 alias 가 같은 파일 내용을 가짐 (LocalS3 는 복사하지 않고 같은 buffer 를 참조)
+    s3 = LocalS3()
+    records = []
+    for jobSeq in range(options['jobs']):
+        alias = _alias if options['jobs'] == 1 else f'{_alias}{jobSeq}'
+        s3.put_object(Bucket=_bucket, Key=f'indices/devel/{alias}/config.json', Body=json.dumps(config))
+        s3Key = f'indices/devel/{alias}/20201211000000.create.csv' + ('.' + compression if compression != '' else '')
+        s3.put_object(Bucket=_bucket, Key=s3Key, Body=data)
+        records.append({'s3': {'bucket': {'name': _bucket}, 'object': {'key': s3Key}}})
+    storedBytes = len(data) * options['jobs']
+    rowCount = case['rows'] * options['jobs']
+    del data
+
+    lambda_function._s3Client = s3
+    lambda_function._usable['slack'] = False
+    lambda_function._elasticsearch['devel']['endpoint'] = f'http://127.0.0.1:{server.server_port}/'
+    lambda_function._bulkRetry['initialBackoffSeconds'] = 0.01
+    lambda_function._jobs['backend'] = 'thread'
+    lambda_function._jobs['maxWorkers'] = options['jobs']
+
+    event = {'Records': records}
+    baseRss = getPeakRssKilobytes()
+
+    # emitMetrics 가 출력하는 EMF record 에서 phase 별 시간을 가져옴
+    output = io.StringIO()
+    stdout = sys.stdout
+    sys.stdout = output
+    startTime = time.perf_counter()
+    try:
+        lambda_function.lambda_handler(event, None)
+    finally:
+        seconds = time.perf_counter() - startTime
+        sys.stdout = stdout
+        server.shutdown()
+
+    # job 마다 한 줄씩 나오므로 시간, 건수는 합계
+    metrics = {}
+    statuses = set()
+    for line in output.getvalue().splitlines():
+        if line.startswith('{') and '"_aws"' in line:
+            record = json.loads(line)
+            statuses.add(record['Status'])
+            for name in ['BulkRetryCount', 'DeadLetterCount', 'ParseSeconds', 'S3ReadSeconds', 'BulkSenderWaitSeconds', 'DedupSeconds']:
+                metrics[name] = metrics.get(name, 0) + record.get(name, 0)
+
+    resultQueue.put({
+        'name': case['name'],
+        'status': statuses.pop() if len(statuses) == 1 else 'mixed' if len(statuses) > 1 else 'unknown',
+        'rows': rowCount,
+        'megaBytes': fileBytes / 1024 / 1024,
+        'storedMegaBytes': storedBytes / 1024 / 1024,
+        'seconds': seconds,
+        'documentsPerSecond': rowCount / seconds,
+        'megaBytesPerSecond': fileBytes / 1024 / 1024 / seconds,
+        'indexedCount': FakeElasticsearchHandler.stats['indexedCount'],
+        'bulkCount': FakeElasticsearchHandler.stats['bulkCount'],
+        'retryCount': metrics.get('BulkRetryCount', 0),
+        'deadLetterCount': metrics.get('DeadLetterCount', 0),
+        'parseSeconds': metrics.get('ParseSeconds', 0.0),
+        # 압축 파일은 S3 stream 을 읽으면서 풀므로 압축 해제 시간은 parse 가 아닌 read 에 포함
+        'readSeconds': metrics.get('S3ReadSeconds', 0.0),
+        'senderWaitSeconds': metrics.get('BulkSenderWaitSeconds', 0.0),
+        'dedupSeconds': metrics.get('DedupSeconds', 0.0),
+        'baseRssMegaBytes': baseRss / 1024,
+        'peakRssMegaBytes': getPeakRssKilobytes() / 1024
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='local lambda_function pipeline throughput benchmark')
+    parser.add_argument('--rows', type=int, default=0, help='run one case with this row count instead of the default cases')
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--array-columns', type=int, default=0)
+    parser.add_argument('--quote-char', default='')
+    parser.add_argument('--latency', type=float, default=0.01, help='fake _bulk response latency in seconds')
+    parser.add_argument('--reject-rate', type=float, default=0.0, help='ratio of _bulk items rejected with 429')
+    parser.add_argument('--gzip-level', type=int, default=0, help='bulkQueue.gzipLevel')
+    parser.add_argument('--duplicate-rate', type=float, default=0.0, help='ratio of rows repeating an earlier _id')
+    parser.add_argument('--dedup', action='store_true', help='dedup.enable')
+    parser.add_argument('--dedup-max-memory-keys', type=int, default=1000000, help='dedup.maxMemoryKeys')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply the row count of the default cases')
+    parser.add_argument('--jobs', type=int, default=1, help='index this many aliases concurrently in one event (thread job backend)')
+    parser.add_argument('--compression', choices=['gz', 'bz2', 'zst'], default='', help='also run each case from a compressed .csv.{gz,bz2,zst} file')
+    args = parser.parse_args()
+
+    cases = [dict(case, rows=int(case['rows'] * args.scale)) for case in _defaultCases]
+    if args.rows > 0:
+        cases = [{'name': 'custom', 'rows': args.rows, 'columns': args.columns, 'arrayColumns': args.array_columns, 'quoteChar': args.quote_char}]
+    if args.compression != '':
+        cases = [compressedCase for case in cases for compressedCase in [case, dict(case, name=case['name'] + '.' + args.compression, compression=args.compression)]]
+
+    options = {
+        'latency': args.latency,
+        'rejectRate': args.reject_rate,
+        'gzipLevel': args.gzip_level,
+        'duplicateRate': args.duplicate_rate,
+        'dedup': args.dedup,
+        'dedupMaxMemoryKeys': args.dedup_max_memory_keys,
+        'jobs': args.jobs
+    }
+    print(f'latency : {args.latency}s, rejectRate : {args.reject_rate}, gzipLevel : {args.gzip_level}, duplicateRate : {args.duplicate_rate}, '
+          f'dedup : {args.dedup}, dedupMaxMemoryKeys : {args.dedup_max_memory_keys}, jobs : {args.jobs}, jobStateBytes : {measureJobStateBytes()}')
+    print(f'{"case":<10} {"status":<8} {"rows":>8} {"MB":>7} {"stored":>7} {"sec":>7} {"docs/s":>9} {"MB/s":>7} {"parse":>6} {"read":>6} {"wait":>6} {"dedup":>6} {"sent":>8} {"retry":>6} {"dead":>5} {"rss MB":>13}')
+
+    context = multiprocessing.get_context('spawn')
+    for case in cases:
+        resultQueue = context.Queue()
+        process = context.Process(target=runCase, args=(case, options, resultQueue))
+        process.start()
+        result = resultQueue.get()
+        process.join()
+
+        print(f'{result["name"]:<10} {result["status"]:<8} {result["rows"]:>8} {result["megaBytes"]:>7.1f} {result["storedMegaBytes"]:>7.1f} {result["seconds"]:>7.2f} '
+              f'{result["documentsPerSecond"]:>9.0f} {result["megaBytesPerSecond"]:>7.2f} {result["parseSeconds"]:>6.2f} {result["readSeconds"]:>6.2f} {result["senderWaitSeconds"]:>6.2f} '
+              f'{result["dedupSeconds"]:>6.2f} {result["indexedCount"]:>8} {result["retryCount"]:>6} {result["deadLetterCount"]:>5} {result["baseRssMegaBytes"]:>6.0f}->{result["peakRssMegaBytes"]:<6.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# delta / dedup merge 와 색인 실패 시 sidecar 처리 확인 (offline, bench_pipeline 의 local S3, fake Elasticsearch 사용)
+# 기대와 다르면 AssertionError
+#   python3 check_delta.py
+import io
+import json
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+from bench_pipeline import FakeElasticsearchHandler, LocalS3
+
+import lambda_function
+
+_bucket = 'check-bucket'
+_alias = 'user'
+
+
+class RecordingElasticsearchHandler(FakeElasticsearchHandler):
+    # 성공으로 응답한 (action, _id) 를 순서대로 기록
+    sent = []
+
+    def bulk(self, body):
+        result = super().bulk(body)
+
+        lines = body.split(b'\n')
+        seq = 0
+        for item in result['items']:
+            action = next(iter(json.loads(lines[seq])))
+            if 'error' not in item[action]:
+                self.sent.append((action, json.loads(lines[seq])[action]['_id']))
+            seq = seq + (1 if action == 'delete' else 2)
+
+        return result
+
+
+def makeCsv(rows = []):
+    return ('id,op,name\n' + ''.join(','.join(row) + '\n' for row in rows)).encode('utf-8')
+
+
+def runFile(s3, fileName, rows = [], alias = _alias):
+    # 파일 하나를 lambda_handler 로 색인하고 (job 결과, 보낸 document, EMF record) 를 돌려줌
+    s3Key = f'indices/devel/{alias}/{fileName}'
+    s3.put_object(Bucket=_bucket, Key=s3Key, Body=makeCsv(rows))
+    RecordingElasticsearchHandler.sent = []
+
+    output = io.StringIO()
+    stdout = sys.stdout
+    sys.stdout = output
+    try:
+        result = lambda_function.lambda_handler({'Records': [{'s3': {'bucket': {'name': _bucket}, 'object': {'key': s3Key}}}]}, None)
+    finally:
+        sys.stdout = stdout
+
+    metrics = {}
+    for line in output.getvalue().splitlines():
+        if line.startswith('{') and '"_aws"' in line:
+            metrics = json.loads(line)
+
+    return result['jobs'][0], sorted(RecordingElasticsearchHandler.sent), metrics
+
+
+def main():
+    lambda_function.log = lambda messge = '': None
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RecordingElasticsearchHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    s3 = LocalS3()
+    config = {
+        'fileFieldDelimiter': ',',
+        'indexMappings': {'mappings': {'properties': {'id': {'type': 'keyword'}, 'name': {'type': 'keyword'}}}},
+        'delta': {'enable': True, 'maxRunRecords': 2},
+        'dedup': {'enable': True},
+        'rowOperation': {'fieldName': 'op'}
+    }
+    s3.put_object(Bucket=_bucket, Key=f'indices/devel/{_alias}/config.json', Body=json.dumps(config))
+    # delta 없이 dedup 만 (makeDedupIndex)
+    dedupConfig = dict(config, delta={'enable': False})
+    s3.put_object(Bucket=_bucket, Key=f'indices/devel/dedup/config.json', Body=json.dumps(dedupConfig))
+
+    lambda_function._s3Client = s3
+    lambda_function._usable['slack'] = False
+    lambda_function._elasticsearch['devel']['endpoint'] = f'http://127.0.0.1:{server.server_port}/'
+    lambda_function._bulkRetry['initialBackoffSeconds'] = 0.01
+
+    try:
+        # create : 모든 row 를 보내고 sidecar 를 만듦
+        # 7 은 마지막 전체 row 앞의 update 를 건너뛰고, 8 은 마지막 전체 row 뒤의 update 를 보냄
+        created = [[str(seq), '', f'name{seq}'] for seq in range(1, 6)]
+        partials = [['7', '', 'v1'], ['7', 'update', 'fix'], ['7', '', 'v2'], ['8', '', 'v1'], ['8', 'update', 'fix']]
+        for alias in [_alias, 'dedup']:
+            result, sent, metrics = runFile(s3, '20201211000000.create.csv', created + partials, alias)
+            assert result['status'] == 'success', result
+            assert sent == [('index', seq) for seq in ['1', '2', '3', '4', '5', '7', '8']] + [('update', '8')], (alias, sent)
+            assert metrics['DedupSkippedCount'] == 2, (alias, metrics)
+
+        # update : 2 변경, 3 삭제, 6 추가, 4 는 중간에 바뀌었다가 마지막 row 가 원래 값 (dedup 후 변경 없음)
+        updated = [['1', '', 'name1'], ['2', '', 'changed'], ['4', '', 'temporary'], ['3', 'delete', ''], ['6', '', 'name6'], ['4', '', 'name4'], ['5', '', 'name5']]
+        result, sent, metrics = runFile(s3, '20201212000000.update.csv', updated)
+        assert result['status'] == 'success', result
+        assert sent == [('delete', '3'), ('index', '2'), ('index', '6')], sent
+        assert metrics['DocumentCount'] == 3, metrics['DocumentCount']
+        assert metrics['DedupSkippedCount'] == 1 and metrics['DeltaSkippedCount'] == 3, metrics
+
+        # 같은 파일을 다시 보내면 delete 만 보냄
+        result, sent, metrics = runFile(s3, '20201213000000.update.csv', updated)
+        assert sent == [('delete', '3')], sent
+        assert metrics['DocumentCount'] == 1, metrics['DocumentCount']
+
+        # 색인에 실패한 row 는 sidecar 에 남지 않아 다시 보내면 색인됨
+        failed = [['5', '', 'failed'], ['6', '', 'name6']]
+        FakeElasticsearchHandler.rejectRate = 1.0
+        lambda_function._bulkRetry['maxRetries'] = 0
+        result, sent, metrics = runFile(s3, '20201214000000.update.csv', failed)
+        assert sent == [] and metrics['DeadLetterCount'] == 1, (sent, metrics)
+
+        FakeElasticsearchHandler.rejectRate = 0.0
+        result, sent, metrics = runFile(s3, '20201215000000.update.csv', failed)
+        assert sent == [('index', '5')], sent
+        assert metrics['DeltaSkippedCount'] == 1, metrics
+
+        # operation 값은 대소문자, 공백을 무시하고 모르는 값은 dead letter 로 남기고 나머지 row 는 색인
+        result, sent, metrics = runFile(s3, '20201216000000.update.csv', [['1', ' DELETE ', ''], ['2', 'remove', ''], ['6', 'Update', 'renamed']])
+        assert result['status'] == 'success', result
+        assert sent == [('delete', '1'), ('update', '6')], sent
+        assert metrics['DeadLetterCount'] == 1, metrics
+    finally:
+        server.shutdown()
+
+    print('check_delta : ok')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,8 @@
 SRC_PATH='../src'
 TEMP_PATH='../temp'
 ZIP_PATH='../dist/function.zip'
+# lambda 함수의 runtime 과 같은 python 버전, 다르면 native wheel 을 import 하지 못함 (PYTHON_VERSION=3.11 sh build.sh)
+PYTHON_VERSION=${PYTHON_VERSION:-3.12}
 
 
 rm -rf ${ZIP_PATH}
@@ -12,6 +14,9 @@ cp lambda_function.py ${TEMP_PATH}
 
 cd ${TEMP_PATH}
 pip3 install requests -t .
-pip3 install requests_aws4auth -t .
+# optional, faster bulk document serialization (lambda runtime 용 wheel)
+pip3 install orjson -t . --platform manylinux2014_x86_64 --python-version ${PYTHON_VERSION} --implementation cp --only-binary=:all:
+# optional, .csv.zst file support
+pip3 install zstandard -t . --platform manylinux2014_x86_64 --python-version ${PYTHON_VERSION} --implementation cp --only-binary=:all:
 zip -r ${ZIP_PATH} .
 cd ${SRC_PATH}
\ No newline at end of file
@@ -1,15 +1,32 @@
-import boto3
+import csv
+import io
 import json
-import requests
-from requests_aws4auth import AWS4Auth
-from urllib.request import Request, urlopen
+import os
+import queue
+import random
+import threading
+import time
 from urllib.error import URLError, HTTPError
 
+# cold start 를 줄이기 위해 boto3, requests 등 무거운 module 은 처음 사용하는 함수 안에서 import
+
+# 설치되어 있으면 bulk document 직렬화에 사용 (dumpsJsonBytes 참고)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 ###########################################################################
 # variable
 ###########################################################################
 _configFileName = 'config.json'
 
+# warm invocation 간 config.json 재사용, ttlSeconds 이내면 S3 요청 없이 사용하고 이후엔 ETag 로 변경 여부만 확인
+_configCache = {
+    'ttlSeconds': 0,
+    'entries': {}
+}
+
 _usable = {
     's3': True,
     'elasticsearch': True,
@@ -50,11 +67,125 @@ _elasticsearch = {
     }
 }
 
-_bulkQueue = {
-    'queue': [],
+_http = {
+    'poolSize': 10,
+    'maxRetries': 2,
+    'connectTimeout': 5,
+    'readTimeout': 120
+}
+
+_bulkQueueDefault = {
     'maxQueueSize': 1000,
-    'addedDocumentCount': 0,
-    'totalDocumentCount': 0
+    'maxQueueBytes': 5 * 1024 * 1024,
+    'senderCount': 4,
+    'maxPendingBatches': 8,
+    'adaptive': True,
+    'minQueueBytes': 512 * 1024,
+    'minSenderCount': 1,
+    'targetLatencySeconds': 3.0,
+    'gzipLevel': 0
+}
+
+_s3Stream = {
+    'chunkSize': 1024 * 1024,
+    'compressions': ['gz', 'zst', 'bz2']
+}
+
+_bulkRetry = {
+    'maxRetries': 5,
+    'initialBackoffSeconds': 0.5,
+    'maxBackoffSeconds': 30,
+    'retryableStatus': [429, 502, 503, 504],
+    # gateway 에러는 elasticsearch 가 이미 색인했을 수 있음 (429 는 색인 전에 거절)
+    'unknownResultStatus': [502, 503, 504],
+    'maxDeadLetterDocuments': 10000
+}
+
+# create 색인 중에는 refresh, replica 를 끄고 rebindAlias 전에 profile 의 indexSettings 로 복원
+_bulkLoadDefault = {
+    'enable': False,
+    'autoGenerateId': False,
+    'waitForGreenSeconds': 300
+}
+
+# create 색인 후 alias 교체 전에 segment 를 합치고 cache 를 warm up
+_finalizeDefault = {
+    'forceMergeSegments': 0,
+    'forceMergeTimeoutSeconds': 600,
+    'warmupQueries': []
+}
+
+# lambda timeout 전에 진행 상황을 S3 에 저장하고 자신을 다시 호출해 이어서 색인, 켜면 job 마다 S3 요청이 늘어나므로 큰 파일용
+_checkpointDefault = {
+    'enable': False,
+    'intervalSeconds': 60,
+    'handoffRemainingMillis': 2 * 60 * 1000
+}
+
+# 큰 파일은 coordinator 가 line 단위 byte range 로 나누어 worker 들이 병렬로 색인
+_fanOutDefault = {
+    'enable': False,
+    'minBytes': 1024 * 1024 * 1024,
+    'rangeBytes': 256 * 1024 * 1024,
+    'maxWorkers': 8,
+    'backend': 'lambda'
+}
+
+# 한 event 의 여러 S3 record 는 각각 하나의 job 으로, backend 에 따라 별도 invocation 이나 같은 process 의 thread 에서 실행 (dispatchJobs 참고)
+# alias 가 다른 job 은 maxWorkers 까지 동시에, 같은 alias 의 job 은 파일 시간 순 (같으면 create 먼저) 으로 하나씩
+_jobs = {
+    'maxWorkers': 4,
+    'backend': 'lambda'
+}
+
+# update 파일에서 지난 색인 이후 바뀌지 않은 row 를 건너뛰기 위해 alias 별로 _id -> row hash 를 S3 에 보관 (makeDeltaIndex 참고)
+# sidecar 는 _id 순으로 정렬된 record (id 길이 2byte, id, hash 8byte) 파일이라 통째로 memory 에 올리지 않고 merge
+_deltaDefault = {
+    'enable': False,
+    'maxRunRecords': 500000
+}
+
+# row 별 bulk action, fieldName 컬럼 값 (비어 있으면 default) 으로 결정 (compileBulkConverter 참고)
+_rowOperationDefault = {
+    'fieldName': '',
+    'default': 'index'
+}
+
+# row operation -> _bulk action, update / upsert 는 비어 있지 않은 컬럼만 doc 으로 보냄
+_rowOperations = {
+    'index': 'index',
+    'update': 'update',
+    'upsert': 'update',
+    'delete': 'delete'
+}
+
+# 같은 _id 가 파일에 여러 번 있으면 마지막 row 만 색인 (makeDedupIndex 참고)
+# memory 의 _id hash -> 마지막 row 번호 가 maxMemoryKeys 를 넘으면 정렬해서 /tmp 에 내려쓰고 마지막에 merge
+_dedupDefault = {
+    'enable': False,
+    'maxMemoryKeys': 1000000
+}
+
+# config.json section -> 기본값, section 에 없는 key 는 기본값 사용 (getConfigValue 참고)
+_configSectionDefaults = {
+    'bulkLoad': _bulkLoadDefault,
+    'finalize': _finalizeDefault,
+    'checkpoint': _checkpointDefault,
+    'fanOut': _fanOutDefault,
+    'delta': _deltaDefault,
+    'dedup': _dedupDefault,
+    'rowOperation': _rowOperationDefault
+}
+
+# slack 알림은 background thread 에서 전송, coalesceSeconds 동안 모인 같은 job 의 메시지는 한 번에 전송
+_slackSender = {
+    'queue': queue.Queue(),
+    'worker': None,
+    'coalesceSeconds': 2.0,
+    'timeoutSeconds': 5,
+    'maxRetries': 2,
+    'drainTimeoutSeconds': 10,
+    'lock': threading.Lock()
 }
 
 _configValues = {
@@ -62,77 +193,97 @@ _configValues = {
     'fromFileName': ['dataTime', 'action']
 }
 
-_config = {
-    's3Bucket': '',
-    's3Key': '',
-    'slack': {},
-    'indexMappings': {},
-    'indexAnalysis': {},
-    'fileFieldDelimiter': '',
-    'fieldArrayDelimiter': '',
-    'indexFieldNames': [],
-    'root': '',
-    'path': '',
-    'alias': '',
-    'realIndex': '',
-    'profile': '',
-    'fileName': '',
-    'dataTime': '',
-    'action': '',
-    'notDeleteIndicies': []
-}
-
 _backupPath = '/backup-index-data-files'
+_deadLetterPath = '/dead-letter-index-data-files'
+_checkpointPath = '/checkpoint-index-data-files'
+_deltaPath = '/delta-index-data-files'
 
-_s3Client = boto3.client('s3')
-# Basic Auth 사용으로 요건 필요 없을 듯....
-# _credentials = boto3.Session().get_credentials()
-# _awsauth = AWS4Auth(_credentials.access_key
-#                     , _credentials.secret_key, _elasticsearch['region'], _elasticsearch['service']
-#                     , session_token=_credentials.token)
+# 처음 사용할 때 생성하고 warm invocation 간 재사용 (getS3Client, getHttpSession 참고)
+_s3Client = None
+_httpSession = None
+_lambdaClient = None
+# thread backend 로 여러 job 이 동시에 처음 사용해도 하나만 생성되도록
+_clientLock = threading.Lock()
 
 ###########################################################################
 # Handler
 ###########################################################################
 def lambda_handler(event, context):
-    try:
-        initConfig(event)
-        setElasticsearchRequestHeader()
-        createIndex()
-        bulk()
-        rebindAlias()
-        deleteOldIndcies()
-        moveS3Object()
-    except HTTPError as e:
-        log("HTTPError : " + str(e))
-        sendMessage('error', 'HTTPError 에러가 발생되었습니다.\n' + str(e))
-    except Exception as e:
-        log("Exception : "+ str(e))
-        sendMessage('error', '에러가 발생되었습니다.\n' + str(e))
-    else:
-        sendMessage('finish', '색인이 종료되었습니다.')
+    if 'fanOut' in event:
+        return IndexingJob().runFanOutWorker(event, context)
+
+    # S3 가 여러 record 를 묶어 보내거나 SQS, SNS 를 거쳐 온 event 도 S3 record 마다 하나의 job 으로 실행
+    records = extractS3Records(event)
+    if len(records) == 0:
+        log('[lambda_handler] no S3 record : ' + json.dumps(event))
+        return {'jobs': []}
+
+    if len(records) > 1:
+        return dispatchJobs(records, context)
+
+    # nextRecords : 같은 alias 의 뒤 job, 이 job 이 handoff 하면 이어서 하는 invocation 이 실행 (runJobGroups 참고)
+    return {'jobs': [IndexingJob().run({'Records': records, 'nextRecords': event.get('nextRecords', [])}, context)]}
 
 ###########################################################################
 # function - common
 ###########################################################################
-def sendMessage(step, message):
-    postToSlack('{slack hook url}', '{slack channel}', message);
+def enqueueSlackMessage(webhookUrl, channel, message, s3Key = '', action = ''):
+    if (_usable['slack'] == False):
+        return 'slack usable : False'
 
-    action = _config['action']
+    # 여러 job 의 메시지가 같은 queue 로 오므로 job 의 s3Key, action 을 같이 넘김
+    _slackSender['queue'].put((webhookUrl, channel, s3Key, action, message))
 
-    if 'webhookUrl' not in _config['slack']:
-        return ''
-    if _config['slack']['webhookUrl'] == '':
-        return ''
-    if step == 'error':
-        postToSlack(_config['slack']['webhookUrl'], _config['slack']['channel'], message);
-        return ''
-    if 'receive' in _config['slack'] and _config['slack']['receive'][action][step] == 'disable':
-        return ''
+    # thread backend 의 job 들이 동시에 호출해도 sender 는 하나만 (drainSlackMessages 가 모든 메시지를 기다리도록)
+    with _slackSender['lock']:
+        if _slackSender['worker'] is None or not _slackSender['worker'].is_alive():
+            _slackSender['worker'] = threading.Thread(target=slackSenderWorker, name='slack-sender', daemon=True)
+            _slackSender['worker'].start()
+
+    return ''
+
+def drainSlackMessages():
+    # lambda 는 handler 반환 후 멈추므로 남은 메시지를 보낼 때까지 기다림
+    if _slackSender['worker'] is None or not _slackSender['worker'].is_alive():
+        return
+
+    drained = threading.Event()
+    _slackSender['queue'].put(drained)
+    if not drained.wait(_slackSender['drainTimeoutSeconds']):
+        log('[drainSlackMessages] timeout')
+
+def slackSenderWorker():
+    senderQueue = _slackSender['queue']
 
-    postToSlack(_config['slack']['webhookUrl'], _config['slack']['channel'], message);
+    while True:
+        items = [senderQueue.get()]
+        deadline = time.monotonic() + _slackSender['coalesceSeconds']
 
-def postToSlack(webhookUrl, channel, message):
+        # drain 요청이 오거나 coalesceSeconds 가 지날 때까지 메시지를 모음
+        while not isinstance(items[-1], threading.Event):
+            remainSeconds = deadline - time.monotonic()
+            if remainSeconds <= 0:
+                break
+            try:
+                items.append(senderQueue.get(timeout=remainSeconds))
+            except queue.Empty:
+                break
+
+        messages = {}
+        for item in items:
+            if isinstance(item, threading.Event):
+                continue
+            webhookUrl, channel, s3Key, action, message = item
+            messages.setdefault((webhookUrl, channel, s3Key, action), []).append(message)
+
+        for key, values in messages.items():
+            webhookUrl, channel, s3Key, action = key
+            postToSlack(webhookUrl, channel, '\n'.join(values), s3Key, action)
+
+        if isinstance(items[-1], threading.Event):
+            items[-1].set()
+
+def postToSlack(webhookUrl, channel, message, s3Key = '', action = ''):
 
     if (_usable['slack'] == False):
         return 'slack usable : False'
@@ -146,13 +297,13 @@ def postToSlack(webhookUrl, channel, message):
                 'type': 'section',
                 'text': {
                     'type': 'mrkdwn',
-                    'text': '*색인대상*:\n' + _config['s3Key']
+                    'text': '*색인대상*:\n' + s3Key
                 }
             },{
                 'type': 'section',
                 'text': {
                     'type': 'mrkdwn',
-                    'text': '*상태*:\n' + _config['action']
+                    'text': '*상태*:\n' + action
                 }
 
             },{
@@ -164,15 +315,30 @@ def postToSlack(webhookUrl, channel, message):
             }]
     }
 
+    from urllib.request import Request, urlopen
+
     req = Request(webhookUrl, json.dumps(slack_message).encode('utf-8'))
-    try:
-        response = urlopen(req)
-        response.read()
-        log("Message posted to " + slack_message['channel'])
-    except HTTPError as e:
-        log("Request failed: " + str(e.code) + " "+ e.reason)
-    except URLError as e:
-        log("Server connection failed:" + e.reason)
+    for attempt in range(_slackSender['maxRetries'] + 1):
+        try:
+            response = urlopen(req, timeout=_slackSender['timeoutSeconds'])
+            response.read()
+            log("Message posted to " + slack_message['channel'])
+            return ''
+        except HTTPError as e:
+            log("Request failed: " + str(e.code) + " "+ str(e.reason))
+            if e.code != 429 and e.code < 500:
+                return ''
+        except (URLError, OSError) as e:
+            log("Server connection failed:" + str(e))
+
+        if attempt < _slackSender['maxRetries']:
+            time.sleep(0.5 * (attempt + 1))
+
+def dumpsJsonBytes(dictionary):
+    if orjson is not None:
+        return orjson.dumps(dictionary)
+
+    return json.dumps(dictionary).encode('utf-8')
 
 def log(messge = ''):
     print('[INFO]', messge)
@@ -183,343 +349,2419 @@ def setValue(dictionary = [], key = '', value = ''):
     else:
         dictionary[key]
 
-def isNotCreateIndex():
-    return (_config['action'] != 'create')
+###########################################################################
+# function - http
+###########################################################################
+def getS3Client():
+    global _s3Client
+
+    with _clientLock:
+        if _s3Client is None:
+            import boto3
+            _s3Client = boto3.client('s3')
+
+    return _s3Client
+
+def invokeSelf(context, payload = {}):
+    # 자기 자신을 동기 호출 (job, fan out worker), 응답을 기다려야 하므로 read timeout 을 lambda 최대 실행시간으로
+    global _lambdaClient
+
+    with _clientLock:
+        if _lambdaClient is None:
+            import boto3
+            import botocore.config
+            _lambdaClient = boto3.client('lambda', config=botocore.config.Config(read_timeout=900, retries={'max_attempts': 0}))
+
+    response = _lambdaClient.invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='RequestResponse',
+        Payload=json.dumps(payload).encode('utf-8'))
+
+    result = json.loads(response['Payload'].read().decode('utf-8'))
+    if 'FunctionError' in response:
+        raise Exception('[invokeSelf] failed : ' + json.dumps(result))
+
+    return result
+
+def getHttpSession():
+    global _httpSession
+
+    with _clientLock:
+        if _httpSession is None:
+            import requests
+            import requests.adapters
+
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=_http['poolSize'],
+                pool_maxsize=getHttpPoolSize(),
+                max_retries=_http['maxRetries'])
+
+            _httpSession = requests.Session()
+            _httpSession.mount('https://', adapter)
+            _httpSession.mount('http://', adapter)
+            log('[getHttpSession] new http session, poolSize : ' + str(getHttpPoolSize()))
+
+    return _httpSession
+
+def getHttpPoolSize():
+    # thread backend 는 maxWorkers 개 job 의 sender 가 같은 pool 을 쓰므로, pool 보다 많은 connection 은 요청마다 버려짐
+    return max(_http['poolSize'], _jobs['maxWorkers'] * _bulkQueueDefault['senderCount'])
+
+def resetHttpSession():
+    # fork 된 process 가 부모의 keep-alive connection 을 같이 쓰지 않도록
+    global _httpSession
+    _httpSession = None
+
+def getHttpTimeout():
+    return (_http['connectTimeout'], _http['readTimeout'])
+
+def logHttpConnectionStats():
+    if _httpSession is None:
+        return
+
+    requestCount = 0
+    newConnectionCount = 0
+    # https, http 에 같은 adapter 를 mount 했으므로 중복 제거
+    for adapter in set(_httpSession.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            requestCount = requestCount + pool.num_requests
+            newConnectionCount = newConnectionCount + pool.num_connections
+
+    reusedConnectionCount = requestCount - newConnectionCount
+    log(f'[httpConnectionStats] requests : {requestCount}, newConnections : {newConnectionCount}, reusedConnections : {reusedConnectionCount}')
 
 ###########################################################################
 # function - config
 ###########################################################################
-def setConfigFromFile(configKeys = []):
-    filePath = _config['path'] + _configFileName
-    log('[setConfigFromFile] ' + _config['s3Bucket'] + ':' + filePath)
+def getConfigFileFromCache(bucket = '', filePath = ''):
+    # cache 된 config 는 invocation 간 공유되므로 수정하지 않고 읽기만 함
+    cacheKey = bucket + ':' + filePath
+    cacheEntry = _configCache['entries'].get(cacheKey)
+    now = time.monotonic()
 
-    configByFile = {}
-    if _usable['s3']:
-        # S3에서 파일을 읽어오는 것으로
-        s3Object = _s3Client.get_object(Bucket=_config['s3Bucket'], Key=filePath)
-        jsonString = s3Object["Body"].read().decode('utf-8')
-        configByFile = json.loads(jsonString)
+    if cacheEntry is not None and now - cacheEntry['loadedTime'] < _configCache['ttlSeconds']:
+        log('[getConfigFileFromCache] ttl hit : ' + cacheKey)
+        return cacheEntry
 
-    for key in configKeys:
-        if key not in configByFile:
-            continue;
-        setValue(_config, key, configByFile[key])
+    try:
+        if cacheEntry is None:
+            s3Object = getS3Client().get_object(Bucket=bucket, Key=filePath)
+        else:
+            s3Object = getS3Client().get_object(Bucket=bucket, Key=filePath, IfNoneMatch=cacheEntry['eTag'])
+    except getS3Client().exceptions.ClientError as e:
+        if e.response['Error']['Code'] not in ['304', 'NotModified']:
+            raise
+
+        log('[getConfigFileFromCache] not modified : ' + cacheKey)
+        cacheEntry['loadedTime'] = now
+        return cacheEntry
+
+    configByFile = json.loads(s3Object["Body"].read().decode('utf-8'))
+
+    mappingFieldNames = frozenset()
+    if 'indexMappings' in configByFile:
+        mappingFieldNames = frozenset(configByFile['indexMappings']['mappings']['properties'].keys())
+
+    cacheEntry = {
+        'eTag': s3Object['ETag'],
+        'loadedTime': now,
+        'config': configByFile,
+        'mappingFieldNames': mappingFieldNames
+    }
+    _configCache['entries'][cacheKey] = cacheEntry
+    log('[getConfigFileFromCache] loaded : ' + cacheKey + ', eTag : ' + s3Object['ETag'])
+    return cacheEntry
 
+###########################################################################
+# function - csv file & bulk Queue
+###########################################################################
+def getRowOperation(fields = [], operationSeq = None, defaultOperation = 'index'):
+    # 대소문자, 앞뒤 공백은 무시, _rowOperations 에 없는 값은 그대로 돌려주고 convert 에서 dead letter
+    if operationSeq is None or operationSeq >= len(fields):
+        return defaultOperation
 
-def initConfig(event = {}):
-    setValue(_config, 's3Bucket', event['Records'][0]['s3']['bucket']['name'])
-    setValue(_config, 's3Key', event['Records'][0]['s3']['object']['key'])
+    return fields[operationSeq].strip().lower() or defaultOperation
 
-    # set config From Path
-    paths = _config['s3Key'].split('/')
-    keySeq = 0
-    for key in _configValues['fromS3Key']:
-        setValue(_config, key, paths[keySeq])
-        keySeq = keySeq + 1
+def isPartialRowOperation(operation = ''):
+    return operation == 'update' or operation == 'upsert'
 
-    setValue(_config, 'path', '/'.join(paths[:3]) + '/')
+def setRowBit(rowBits, rowSeq = 0):
+    # row 번호 bitmap (delta, dedup), 모자라면 늘림
+    if rowSeq >> 3 >= len(rowBits):
+        rowBits.extend(bytes((rowSeq >> 3) - len(rowBits) + 1024))
 
-    # set config From fileName
-    indexInfo = _config['fileName'].split('.')
+    rowBits[rowSeq >> 3] |= 1 << (rowSeq & 7)
 
-    fileNameValidate(indexInfo)
+def hasRowBit(rowBits, rowSeq = 0):
+    if rowSeq >> 3 >= len(rowBits):
+        return False
 
-    keySeq = 0
-    for key in _configValues['fromFileName']:
-        setValue(_config, key, indexInfo[keySeq])
-        keySeq = keySeq + 1
+    return (rowBits[rowSeq >> 3] >> (rowSeq & 7)) & 1 == 1
 
-    # set real index name
-    indexSuffx = ''
-    if (_config['action'] == 'create'):
-        indexSuffx = '-' + _config['dataTime']
+def countRowBits(rowBits):
+    return sum(bin(value).count('1') for value in rowBits)
 
-    setValue(_config, 'realIndex', _config['alias'] + indexSuffx)
+def makeStreamPosition(startOffset = 0):
+    # 마지막으로 읽은 line 의 위치, byte offset 은 필요할 때만 계산 (getStreamByteOffset)
+    return {
+        'blockOffset': startOffset,
+        'blockText': '',
+        'blockIsAscii': True,
+        'charOffset': 0
+    }
 
-    configPropertyValidate()
+def getStreamByteOffset(position = {}):
+    if position['blockIsAscii']:
+        return position['blockOffset'] + position['charOffset']
 
-    # set Config From config.json
-    setConfigFromFile(['slack','fileFieldDelimiter','indexMappings', 'indexAnalysis', 'fieldArrayDelimiter'])
+    return position['blockOffset'] + len(position['blockText'][:position['charOffset']].encode('utf-8'))
 
-    log('[_config] ' + json.dumps(_config))
+###########################################################################
+# function - delta
+###########################################################################
+def writeDeltaRecord(file, idBytes, rowHash, rowSeq = None):
+    import struct
 
-    sendMessage('start', '색인이 시작되었습니다.')
+    if len(idBytes) > 0xFFFF:
+        raise Exception('[writeDeltaRecord] _id is too long : ' + str(len(idBytes)))
 
-def setElasticsearchRequestHeader():
-    profile = _config['profile']
-    authorizationValue = 'Basic ' + _elasticsearch[profile]['Authorization']
-    setValue(_elasticsearch['headers'], 'Authorization', authorizationValue)
-    log('[elasticsearchRequestHeader] ' + json.dumps(_elasticsearch['headers']))
+    file.write(struct.pack('>H', len(idBytes)))
+    file.write(idBytes)
+    if rowSeq is not None:
+        file.write(struct.pack('>Q', rowSeq))
+    file.write(rowHash)
 
+###########################################################################
+# function - fan out
+###########################################################################
+def dispatchByLambda(workerEvents = [], context = None, maxWorkers = 1, onResult = None):
+    # worker 마다 자기 자신을 동기 호출
+    import concurrent.futures
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        return collectFanOutResults([executor.submit(invokeSelf, context, workerEvent) for workerEvent in workerEvents], onResult)
+
+def dispatchByProcessPool(workerEvents = [], context = None, maxWorkers = 1, onResult = None):
+    # AWS 없이 로컬에서 fan out 을 실행하기 위한 backend (lambda 환경에서는 multiprocessing 불가)
+    # worker event 에 fanOut 이 있으므로 lambda_handler 가 runFanOutWorker 로 보냄
+    import concurrent.futures
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=maxWorkers, initializer=resetHttpSession) as executor:
+        return collectFanOutResults([executor.submit(lambda_handler, workerEvent, None) for workerEvent in workerEvents], onResult)
+
+def collectFanOutResults(futures = [], onResult = None):
+    # 끝난 순서대로 onResult 를 호출, coordinator 가 중간에 멈춰도 끝난 range 는 checkpoint 에 남도록
+    import concurrent.futures
+
+    # 실패한 worker 가 있어도 나머지가 끝날 때까지 기다려서 기록한 후 raise
+    results = []
+    error = None
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            result = future.result()
+        except Exception as e:
+            error = error or e
+            continue
+
+        if onResult is not None:
+            onResult(result)
+        results.append(result)
+
+    if error is not None:
+        raise error
+
+    return results
+
+_fanOutBackends = {
+    'lambda': dispatchByLambda,
+    'process': dispatchByProcessPool
+}
 
-def makeElasticsearchUrl(path = ''):
-    profile = _config['profile']
-    endPoint = _elasticsearch[profile]['endpoint']
-    return f'{endPoint}{path}'
+###########################################################################
+# function - job
+###########################################################################
+def extractS3Records(event = {}):
+    # SNS 는 Message, SQS 는 body 에 S3 event (SNS -> SQS 면 body 가 SNS envelope) 가 json 문자열로 들어 있음
+    records = []
+
+    for record in event.get('Records', []):
+        if 's3' in record:
+            records.append(record)
+        elif 'Sns' in record:
+            records.extend(extractS3Records(json.loads(record['Sns']['Message'])))
+        elif 'body' in record:
+            body = json.loads(record['body'])
+            if 'Records' not in body and 'Message' in body:
+                body = json.loads(body['Message'])
+            records.extend(extractS3Records(body))
+
+    return records
+
+def makeJobOrderKey(record = {}):
+    # {time}.{action}.csv 의 시간 순, 같은 시간이면 create 가 update 보다 먼저
+    indexInfo = record['s3']['object']['key'].split('/')[-1].split('.')
+    if len(indexInfo) < 2:
+        return ('', True)
+
+    return (indexInfo[0], indexInfo[1] != 'create')
+
+def dispatchJobs(records = [], context = None):
+    # 같은 alias 경로의 record 를 모아 순서대로 정렬, 앞의 job 이 끝나야 다음 job 을 시작
+    aliasRecords = {}
+    for record in records:
+        aliasPath = record['s3']['bucket']['name'] + ':' + record['s3']['object']['key'].rsplit('/', 1)[0]
+        aliasRecords.setdefault(aliasPath, []).append(record)
+
+    groups = [sorted(group, key=makeJobOrderKey) for group in aliasRecords.values()]
+    backend = _jobs['backend']
+    log(f'[dispatchJobs] records : {len(records)}, aliases : {len(groups)}, backend : {backend}')
+
+    results = _jobBackends[backend](groups, context)
+
+    for result in results:
+        log('[dispatchJobs] job result : ' + json.dumps(result))
+
+    return {'jobs': results}
+
+def runJobGroups(groups = [], runJob = None):
+    # alias 별로 thread 하나가 job 을 순서대로 실행
+    # handoff 한 job 은 뒤 job 들을 nextRecords 로 넘겨 이어서 하는 invocation 이 순서대로 실행
+    # 실패하면 같은 alias 의 뒤 job 은 실행하지 않고 slack 으로 알림, 건너뛴 파일은 S3 에 그대로 남아 있으므로 다시 올리면 색인됨
+    import concurrent.futures
+
+    def runGroup(records):
+        results = []
+        for recordSeq in range(len(records)):
+            record = records[recordSeq]
+            s3Key = record['s3']['object']['key']
+
+            if len(results) > 0 and results[-1]['status'] in ['handoff', 'queued']:
+                results.append({'s3Key': s3Key, 'status': 'queued', 'error': 'runs after the handoff of the same alias'})
+                continue
+
+            if len(results) > 0 and results[-1]['status'] != 'success':
+                results.append(IndexingJob().skip({'Records': [record]}, 'previous job of the same alias : ' + results[-1]['status']))
+                continue
+
+            try:
+                results.append(runJob({'Records': [record], 'nextRecords': records[recordSeq + 1:]}))
+            except Exception as e:
+                results.append({'s3Key': s3Key, 'status': 'error', 'error': str(e)})
+
+        return results
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(int(_jobs['maxWorkers']), len(groups))) as executor:
+        return [result for results in executor.map(runGroup, groups) for result in results]
+
+def dispatchJobsByLambda(groups = [], context = None):
+    # job 마다 자기 자신을 동기 호출, job 의 config, queue, 통계는 각 invocation 에만 있음
+    return runJobGroups(groups, lambda jobEvent: invokeSelf(context, jobEvent)['jobs'][0])
+
+def dispatchJobsByProcessPool(groups = [], context = None):
+    # AWS 없이 로컬에서 실행하기 위한 backend, job 마다 pool 의 process 에서 실행
+    import concurrent.futures
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=int(_jobs['maxWorkers']), initializer=resetHttpSession) as executor:
+        return runJobGroups(groups, lambda jobEvent: executor.submit(lambda_handler, jobEvent, None).result()['jobs'][0])
+
+def dispatchJobsByThread(groups = [], context = None):
+    # 같은 invocation 에서 job 마다 IndexingJob 을 만들어 실행, S3 client, http connection pool 은 job 들이 같이 사용
+    return runJobGroups(groups, lambda jobEvent: IndexingJob().run(jobEvent, context))
+
+_jobBackends = {
+    'lambda': dispatchJobsByLambda,
+    'process': dispatchJobsByProcessPool,
+    'thread': dispatchJobsByThread
+}
 
+###########################################################################
+# function - metrics
+###########################################################################
+def getPeakRssKilobytes():
+    # 같은 process 의 최대값이라 warm invocation 에서는 이전 invocation 의 최대값일 수 있음
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def makeMetricName(name = ''):
+    return name[0].upper() + name[1:]
 
 ###########################################################################
-# function - csv file & bulk Queue
+# function - Elasticsearch
 ###########################################################################
-def fileNameValidate(indexInfo = []):
-    fileNameFormatLength = len(indexInfo)
-    fileName = _config['fileName']
+def hasRejectedBulkItems(responseItems = []):
+    for responseItem in responseItems:
+        if list(responseItem.values())[0]['status'] in _bulkRetry['retryableStatus']:
+            return True
 
-    if (fileNameFormatLength < 3):
-        raise Exception(f'[fileNameValidate] Please check s3 data filename : {fileName}. e.g., 20210222113500.create.csv')
+    return False
 
-def configPropertyValidate():
-    action = _config['action']
+def sleepBackoff(attempt = 0):
+    # exponential backoff + full jitter
+    backoff = min(_bulkRetry['maxBackoffSeconds'], _bulkRetry['initialBackoffSeconds'] * (2 ** attempt))
+    time.sleep(random.uniform(0, backoff))
 
-    if (action != 'create' and action !='update'):
-        raise Exception(f'[configPropertyValidate] Please check action value : {action}')
+###########################################################################
+# IndexingJob
+###########################################################################
+class IndexingJob:
+    # 파일 하나를 색인하는 job, config, 변환 함수, bulk queue, 통계를 모두 instance 에 두어
+    # 같은 container 에서 여러 job 을 동시에 실행해도 섞이지 않고 warm invocation 간에도 남지 않음
+    # attribute 를 __slots__ 로 고정해 instance 마다 __dict__ 를 만들지 않음
+    __slots__ = (
+        'config',
+        'configDerived',
+        'headers',
+        'bulkQueue',
+        'bulkSender',
+        'bulkThrottle',
+        'bulkCompression',
+        'deadLetter',
+        'checkpoint',
+        'fanOut',
+        'delta',
+        'dedup',
+        'bulkConverter',
+        'metrics'
+    )
 
+    def __init__(self):
+        self.headers = dict(_elasticsearch['headers'])
 
-def headerValidate(fields = []):
-    properties = _config['indexMappings']['mappings']['properties']
+        # config.json 으로 미리 계산해 cache 와 같이 보관하는 값
+        self.configDerived = {
+            'mappingFieldNames': frozenset()
+        }
 
-    for field in fields:
-        properties[field]
+        # 직렬화된 ndjson 을 바로 쌓는 byte buffer
+        self.bulkQueue = {
+            'buffer': bytearray(),
+            'maxQueueSize': _bulkQueueDefault['maxQueueSize'],
+            'maxQueueBytes': _bulkQueueDefault['maxQueueBytes'],
+            'senderCount': _bulkQueueDefault['senderCount'],
+            'maxPendingBatches': _bulkQueueDefault['maxPendingBatches'],
+            'adaptive': _bulkQueueDefault['adaptive'],
+            'minQueueBytes': _bulkQueueDefault['minQueueBytes'],
+            'minSenderCount': _bulkQueueDefault['minSenderCount'],
+            'targetLatencySeconds': _bulkQueueDefault['targetLatencySeconds'],
+            'gzipLevel': _bulkQueueDefault['gzipLevel'],
+            'addedDocumentCount': 0,
+            'totalDocumentCount': 0
+        }
 
+        # parse 와 _bulk 전송을 분리하기 위한 sender thread (startBulkSenders 참고)
+        self.bulkSender = {
+            'queue': None,
+            'workers': [],
+            'errors': []
+        }
 
-def fieldsValidate(fields = []):
-    fieldsLength = len(fields)
-    headersLength = len(_config['indexFieldNames'])
+        # _bulk 응답 latency, reject 에 따라 batch 크기와 동시 요청 수를 조절 (AIMD)
+        # min ~ max 범위는 bulkQueue 의 minQueueBytes ~ maxQueueBytes, minSenderCount ~ senderCount
+        self.bulkThrottle = {
+            'batchBytes': 0,
+            'inFlightWindow': 0.0,
+            'activeCount': 0,
+            'lastDecreaseTime': 0.0,
+            'responseCount': 0,
+            'increaseBatchBytes': 256 * 1024,
+            'decreaseFactor': 0.5,
+            'logInterval': 50,
+            'condition': threading.Condition()
+        }
 
-    if (fieldsLength != headersLength):
-        raise Exception(f'[fieldsValidate] fieldCount Not Equals Headers, headersLength : {headersLength}, fieldsLength : {fieldsLength}')
+        # gzip 압축 전/후 _bulk 요청 크기 (sender thread 에서 집계)
+        self.bulkCompression = {
+            'batchCount': 0,
+            'rawBytes': 0,
+            'compressedBytes': 0,
+            'lock': threading.Lock()
+        }
 
+        # 재시도 후에도 실패한 document (action line, source line) 와 통계
+        self.deadLetter = {
+            'items': [],
+            'retriedDocumentCount': 0,
+            'lock': threading.Lock()
+        }
 
-def isFullBulkQueue():
-    return _bulkQueue['maxQueueSize'] <= _bulkQueue['addedDocumentCount']
+        # checkpoint 로 이어서 색인할 위치와 handoff 상태 (_checkpointDefault 참고)
+        self.checkpoint = {
+            'context': None,
+            'event': {},
+            'eTag': '',
+            'status': '',
+            'startOffset': 0,
+            'startRecordCount': 0,
+            'deadLetterCount': 0,
+            'lastSavedTime': 0.0,
+            'handedOff': False
+        }
 
+        self.fanOut = {
+            'role': '',
+            'rangeEnd': None,
+            'probeBytes': 64 * 1024,
+            'ranges': [],
+            'finishedRanges': {}
+        }
 
-def isEmptyBulkQueue():
-    return len(_bulkQueue['queue']) == 0
+        self.delta = {
+            'tmpPath': '/tmp',
+            'hashBytes': 8,
+            'deletedHash': bytes(8),
+            'changedRows': None,
+            'indexFilePath': '',
+            'skippedCount': 0
+        }
 
+        self.dedup = {
+            'tmpPath': '/tmp',
+            'keyBytes': 16,
+            'keptRows': None
+        }
 
-def addBulkQueue(dictionary):
-    _bulkQueue['queue'].append(json.dumps(dictionary))
+        # header 로 한 번 만들어 두고 row 마다 사용하는 (action line, document) 변환 함수 (compileBulkConverter 참고)
+        self.bulkConverter = {
+            'convert': None
+        }
 
+        # invocation 당 한 줄의 CloudWatch EMF (Embedded Metric Format) json 으로 출력하는 phase 별 시간, 처리량 (emitMetrics 참고)
+        self.metrics = {
+            'namespace': 'S3CsvToElasticsearch',
+            'latencyBounds': [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120],
+            'startTime': 0.0,
+            'phaseSeconds': {},
+            'values': {},
+            'latencyCounts': [],
+            'lock': threading.Lock()
+        }
 
-def clearBulkQueue():
-    _bulkQueue['addedDocumentCount'] = 0
-    _bulkQueue['queue'].clear()
+        self.config = {
+            's3Bucket': '',
+            's3Key': '',
+            'slack': {},
+            'bulkQueue': {},
+            'bulkLoad': {},
+            'finalize': {},
+            'checkpoint': {},
+            'fanOut': {},
+            'delta': {},
+            'dedup': {},
+            'rowOperation': {},
+            'indexMappings': {},
+            'indexAnalysis': {},
+            'fileFieldDelimiter': '',
+            'fileQuoteChar': '',
+            'fieldArrayDelimiter': '',
+            'arrayFieldNames': [],
+            'indexFieldNames': [],
+            'root': '',
+            'path': '',
+            'alias': '',
+            'realIndex': '',
+            'profile': '',
+            'fileName': '',
+            'fileCompression': '',
+            'dataTime': '',
+            'action': '',
+            'notDeleteIndicies': []
+        }
 
-def increaseAddedDocumentCount():
-    setValue(_bulkQueue, 'addedDocumentCount', _bulkQueue['addedDocumentCount'] + 1)
-    increaseTotalDocumentCount()
+    #######################################################################
+    # run
+    #######################################################################
+    def run(self, event, context):
+        self.resetMetrics()
+        result = {
+            's3Key': event['Records'][0]['s3']['object']['key'],
+            'status': 'error',
+            'error': ''
+        }
 
-def increaseTotalDocumentCount():
-    setValue(_bulkQueue, 'totalDocumentCount', _bulkQueue['totalDocumentCount'] + 1)
+        try:
+            self.runPhase('initConfig', self.initConfig, event)
+            self.sendMessage('start', '색인이 시작되었습니다.')
+            self.setElasticsearchRequestHeader()
+            self.runPhase('loadCheckpoint', self.loadCheckpoint, event, context)
+            self.runPhase('delta', self.makeDeltaIndex)
+            self.runPhase('dedup', self.makeDedupIndex)
+            self.runPhase('createIndex', self.createIndex)
+            if self.isFanOutMode():
+                self.runPhase('bulk', self.fanOutBulk, context)
+            else:
+                self.runPhase('bulk', self.bulk)
+            if self.isHandedOff():
+                result['status'] = 'handoff'
+                return result
+            self.runPhase('forceMerge', self.forceMergeIndex)
+            self.runPhase('restoreIndexSettings', self.restoreIndexSettings)
+            self.runPhase('warmUp', self.warmUpIndex)
+            self.runPhase('rebindAlias', self.rebindAlias)
+            self.runPhase('deleteOldIndices', self.deleteOldIndcies)
+            self.runPhase('putDeltaIndex', self.putDeltaIndex)
+            self.runPhase('moveS3Object', self.moveS3Object)
+            self.deleteCheckpoint()
+        except HTTPError as e:
+            log("HTTPError : " + str(e))
+            result['error'] = str(e)
+            self.sendMessage('error', 'HTTPError 에러가 발생되었습니다.\n' + str(e))
+        except Exception as e:
+            log("Exception : "+ str(e))
+            result['error'] = str(e)
+            self.sendMessage('error', '에러가 발생되었습니다.\n' + str(e))
+        else:
+            result['status'] = 'success'
+            self.sendMessage('finish', '색인이 종료되었습니다.')
+        finally:
+            self.clearDelta()
+            self.clearDedup()
+            logHttpConnectionStats()
+            self.emitMetrics(result['status'])
+            drainSlackMessages()
+
+        return result
+
+    def skip(self, event, reason = ''):
+        # 앞 job 이 실패해서 색인하지 않은 파일, 파일의 config.json 의 slack 설정으로 알림
+        result = {
+            's3Key': event['Records'][0]['s3']['object']['key'],
+            'status': 'skipped',
+            'error': reason
+        }
+
+        try:
+            self.initConfig(event)
+            self.sendMessage('error', '색인하지 않았습니다. 파일을 다시 올리면 색인됩니다.\n' + reason)
+        except Exception as e:
+            log('[skip] Exception : ' + str(e))
+        finally:
+            drainSlackMessages()
+
+        return result
+
+    #######################################################################
+    # function - common
+    #######################################################################
+    def sendMessage(self, step, message):
+        # fan out worker 는 error 만 알리고 나머지는 coordinator 가 알림
+        if (self.isFanOutWorker() and step != 'error'):
+            return ''
+
+        action = self.config['action']
+
+        if 'webhookUrl' not in self.config['slack']:
+            return ''
+        if self.config['slack']['webhookUrl'] == '':
+            return ''
+        if step == 'error':
+            enqueueSlackMessage(self.config['slack']['webhookUrl'], self.config['slack']['channel'], message, self.config['s3Key'], action)
+            return ''
+        if 'receive' in self.config['slack'] and self.config['slack']['receive'][action][step] == 'disable':
+            return ''
+
+        enqueueSlackMessage(self.config['slack']['webhookUrl'], self.config['slack']['channel'], message, self.config['s3Key'], action)
+
+    def isNotCreateIndex(self):
+        return (self.config['action'] != 'create')
+
+    def getConfigValue(self, section = '', key = ''):
+        # alias 별 config.json 의 section 에 없으면 _configSectionDefaults 의 기본값
+        if key in self.config[section]:
+            return self.config[section][key]
+
+        return _configSectionDefaults[section][key]
+
+    def isBulkLoadMode(self):
+        if (self.isNotCreateIndex() or self.config['alias'] == self.config['realIndex']):
+            return False
+
+        return self.getConfigValue('bulkLoad', 'enable') == True
+
+    def isAutoGenerateId(self):
+        return self.isBulkLoadMode() and self.getConfigValue('bulkLoad', 'autoGenerateId') == True
+
+    #######################################################################
+    # function - config
+    #######################################################################
+    def setConfigFromFile(self, configKeys = []):
+        filePath = self.config['path'] + _configFileName
+        log('[setConfigFromFile] ' + self.config['s3Bucket'] + ':' + filePath)
+
+        configByFile = {}
+        mappingFieldNames = frozenset()
+        if _usable['s3']:
+            # S3에서 파일을 읽어오는 것으로
+            cacheEntry = getConfigFileFromCache(self.config['s3Bucket'], filePath)
+            configByFile = cacheEntry['config']
+            mappingFieldNames = cacheEntry['mappingFieldNames']
+
+        for key in configKeys:
+            if key not in configByFile:
+                continue;
+            setValue(self.config, key, configByFile[key])
+
+        setValue(self.configDerived, 'mappingFieldNames', mappingFieldNames)
+
+    def initConfig(self, event = {}):
+        setValue(self.config, 's3Bucket', event['Records'][0]['s3']['bucket']['name'])
+        setValue(self.config, 's3Key', event['Records'][0]['s3']['object']['key'])
+
+        # set config From Path
+        paths = self.config['s3Key'].split('/')
+        keySeq = 0
+        for key in _configValues['fromS3Key']:
+            setValue(self.config, key, paths[keySeq])
+            keySeq = keySeq + 1
+
+        setValue(self.config, 'path', '/'.join(paths[:3]) + '/')
+
+        # set config From fileName
+        indexInfo = self.config['fileName'].split('.')
+
+        self.fileNameValidate(indexInfo)
+
+        keySeq = 0
+        for key in _configValues['fromFileName']:
+            setValue(self.config, key, indexInfo[keySeq])
+            keySeq = keySeq + 1
+
+        # {time}.{action}.csv.{gz|zst|bz2}
+        fileCompression = ''
+        if (len(indexInfo) > 3):
+            fileCompression = indexInfo[3]
+        setValue(self.config, 'fileCompression', fileCompression)
+
+        # set real index name
+        indexSuffx = ''
+        if (self.config['action'] == 'create'):
+            indexSuffx = '-' + self.config['dataTime']
+
+        setValue(self.config, 'realIndex', self.config['alias'] + indexSuffx)
+
+        self.configPropertyValidate()
+
+        # set Config From config.json
+        setValue(self.config, 'bulkQueue', {})
+        setValue(self.config, 'bulkLoad', {})
+        setValue(self.config, 'finalize', {})
+        setValue(self.config, 'checkpoint', {})
+        setValue(self.config, 'fanOut', {})
+        setValue(self.config, 'delta', {})
+        setValue(self.config, 'dedup', {})
+        setValue(self.config, 'rowOperation', {})
+        setValue(self.config, 'arrayFieldNames', [])
+        setValue(self.config, 'fileQuoteChar', '')
+        self.setConfigFromFile(['slack','fileFieldDelimiter','fileQuoteChar','indexMappings', 'indexAnalysis', 'fieldArrayDelimiter', 'arrayFieldNames', 'bulkQueue', 'bulkLoad', 'finalize', 'checkpoint', 'fanOut', 'delta', 'dedup', 'rowOperation'])
+        self.setBulkQueueFromConfig()
+
+        log('[config] ' + json.dumps(self.config))
+
+
+    def setElasticsearchRequestHeader(self):
+        profile = self.config['profile']
+        authorizationValue = 'Basic ' + _elasticsearch[profile]['Authorization']
+        setValue(self.headers, 'Authorization', authorizationValue)
+        log('[elasticsearchRequestHeader] ' + json.dumps(self.headers))
+
+    def makeElasticsearchUrl(self, path = ''):
+        profile = self.config['profile']
+        endPoint = _elasticsearch[profile]['endpoint']
+        return f'{endPoint}{path}'
+
+    #######################################################################
+    # function - csv file & bulk Queue
+    #######################################################################
+    def fileNameValidate(self, indexInfo = []):
+        fileNameFormatLength = len(indexInfo)
+        fileName = self.config['fileName']
+
+        if (fileNameFormatLength < 3):
+            raise Exception(f'[fileNameValidate] Please check s3 data filename : {fileName}. e.g., 20210222113500.create.csv')
+
+        if (fileNameFormatLength > 3 and indexInfo[3] not in _s3Stream['compressions']):
+            raise Exception(f'[fileNameValidate] Please check s3 data filename : {fileName}. compression must be one of ' + ', '.join(_s3Stream['compressions']))
+
+    def configPropertyValidate(self):
+        action = self.config['action']
+
+        if (action != 'create' and action !='update'):
+            raise Exception(f'[configPropertyValidate] Please check action value : {action}')
+
+    def headerValidate(self, fields = []):
+        mappingFieldNames = self.configDerived['mappingFieldNames']
+
+        operationFieldName = self.getConfigValue('rowOperation', 'fieldName')
+
+        for field in fields:
+            if field == operationFieldName:
+                continue
+            if field not in mappingFieldNames:
+                raise Exception(f'[headerValidate] {field} is not in indexMappings properties')
+
+    def compileBulkConverter(self):
+        # row 마다 config 를 조회하지 않도록 header, 배열 가능 컬럼, action line prefix 를 미리 계산
+        fieldNames = list(self.config['indexFieldNames'])
+        headersLength = len(fieldNames)
+        arrayDelimiter = self.config['fieldArrayDelimiter']
+        arrayFieldNames = self.config['arrayFieldNames']
+
+        operationSeq = self.findRowOperationFieldSeq(fieldNames)
+
+        arrayFieldSeqs = ()
+        if arrayDelimiter != '':
+            arrayFieldSeqs = tuple(seq for seq in range(headersLength) if seq != operationSeq and (len(arrayFieldNames) == 0 or fieldNames[seq] in arrayFieldNames))
+
+        operationFieldName = self.getConfigValue('rowOperation', 'fieldName')
+        defaultOperation = self.getConfigValue('rowOperation', 'default')
+        if defaultOperation not in _rowOperations:
+            raise Exception(f'[compileBulkConverter] unknown rowOperation default : {defaultOperation}')
+
+        # operation 별 action line prefix, 예) {"update":{"_index":"alias-1","_id":
+        indexJson = dumpsJsonBytes(self.config['realIndex'])
+        actionPrefixes = {operation: b'{"' + action.encode('utf-8') + b'":{"_index":' + indexJson + b',"_id":' for operation, action in _rowOperations.items()}
+        actionPrefix = actionPrefixes['index']
+
+        if self.isAutoGenerateId():
+            if operationSeq is not None or defaultOperation != 'index':
+                raise Exception('[compileBulkConverter] rowOperation needs _id, disable bulkLoad.autoGenerateId')
+            # checkpoint 에서 이어서 하면 마지막 checkpoint 이후 보낸 batch 를 다시 보내므로 _id 가 없으면 중복 document
+            if self.isCheckpointMode():
+                raise Exception('[compileBulkConverter] checkpoint resume re-sends documents, disable checkpoint.enable with bulkLoad.autoGenerateId')
+            idSeq = None
+            actionPrefix = b'{"index":{"_index":' + indexJson
+        else:
+            idSeq = 0
 
-def makeBulkJsonAndAddQueue(fields = []):
-    fieldsValidate(fields)
+        def convert(fields):
+            fieldsLength = len(fields)
+            if (fieldsLength != headersLength):
+                raise Exception(f'[fieldsValidate] fieldCount Not Equals Headers, headersLength : {headersLength}, fieldsLength : {fieldsLength}')
 
-    id = fields[0]
-    header = {'index': {'_index': _config['realIndex'], '_id': id}}
-    body = {}
+            operation = defaultOperation
+            body = dict(zip(fieldNames, fields))
+            if operationSeq is not None:
+                operation = fields[operationSeq].strip().lower() or defaultOperation
+                del body[operationFieldName]
+
+            if idSeq is None:
+                for seq in arrayFieldSeqs:
+                    if arrayDelimiter in fields[seq]:
+                        body[fieldNames[seq]] = fields[seq].split(arrayDelimiter)
+                return actionPrefix + b'}}', body
+
+            idJson = dumpsJsonBytes(fields[idSeq])
+
+            # 모르는 operation 은 파일 중간에 멈추지 않도록 보내지 않고 dead letter, action 자리에 원래 값을 남김
+            if operation not in actionPrefixes:
+                actionLine = dumpsJsonBytes({fields[operationSeq]: {'_index': self.config['realIndex'], '_id': fields[idSeq]}})
+                self.addDeadLetter((actionLine, dumpsJsonBytes(body)), {'status': 400, 'error': {'type': 'unknown_row_operation', 'reason': operation}})
+                return None, None
+
+            # delete 는 action line 만 보냄
+            if operation == 'delete':
+                return actionPrefixes['delete'] + idJson + b'}}', None
+
+            for seq in arrayFieldSeqs:
+                if arrayDelimiter in fields[seq]:
+                    body[fieldNames[seq]] = fields[seq].split(arrayDelimiter)
 
-    for fieldSeq in range(len(fields)):
-        fieldName = _config['indexFieldNames'][fieldSeq]
-        if _config['fieldArrayDelimiter'] != '' and _config['fieldArrayDelimiter'] in fields[fieldSeq]:
-            body[fieldName] = fields[fieldSeq].split(_config['fieldArrayDelimiter'])
+            if operation == 'index':
+                return actionPrefix + idJson + b'}}', body
+
+            # 부분 update, 빈 컬럼은 기존 값을 유지
+            document = {'doc': {name: value for name, value in body.items() if value != ''}}
+            if operation == 'upsert':
+                document['doc_as_upsert'] = True
+
+            return actionPrefixes[operation] + idJson + b'}}', document
+
+        self.bulkConverter['convert'] = convert
+        log(f'[compileBulkConverter] fields : {headersLength}, arrayFields : {len(arrayFieldSeqs)}, operationField : {operationSeq}, defaultOperation : {defaultOperation}')
+
+    def findRowOperationFieldSeq(self, fieldNames = []):
+        # operation 컬럼이 없는 파일은 모든 row 가 default operation
+        operationFieldName = self.getConfigValue('rowOperation', 'fieldName')
+        if operationFieldName == '' or operationFieldName not in fieldNames:
+            return None
+
+        return list(fieldNames).index(operationFieldName)
+
+    def setBulkQueueFromConfig(self):
+        # alias 별 config.json 에 없으면 기본값 사용 (warm invocation 간 값이 남지 않도록)
+        for key in _bulkQueueDefault:
+            value = _bulkQueueDefault[key]
+            if key in self.config['bulkQueue']:
+                value = type(value)(self.config['bulkQueue'][key])
+            setValue(self.bulkQueue, key, value)
+
+        # thread backend 는 job 들이 http pool 을 나눠 쓰므로 job 당 sender 를 pool 의 몫까지로 제한
+        if _jobs['backend'] == 'thread':
+            maxSenderCount = max(1, getHttpPoolSize() // _jobs['maxWorkers'])
+            setValue(self.bulkQueue, 'senderCount', min(self.bulkQueue['senderCount'], maxSenderCount))
+            setValue(self.bulkQueue, 'minSenderCount', min(self.bulkQueue['minSenderCount'], maxSenderCount))
+
+        log('[setBulkQueueFromConfig] ' + json.dumps({key: self.bulkQueue[key] for key in _bulkQueueDefault}))
+
+    def isFullBulkQueue(self):
+        if self.getBulkBatchBytes() <= len(self.bulkQueue['buffer']):
+            return True
+
+        return self.bulkQueue['maxQueueSize'] <= self.bulkQueue['addedDocumentCount']
+
+    def isEmptyBulkQueue(self):
+        return len(self.bulkQueue['buffer']) == 0
+
+    def addBulkQueue(self, dictionary):
+        self.addBulkQueueLine(dumpsJsonBytes(dictionary))
+
+    def addBulkQueueLine(self, line = b''):
+        buffer = self.bulkQueue['buffer']
+        buffer += line
+        buffer += b'\n'
+
+    def clearBulkQueue(self):
+        self.bulkQueue['addedDocumentCount'] = 0
+        # 할당된 buffer 를 다음 batch 에서 재사용
+        del self.bulkQueue['buffer'][:]
+
+    def increaseAddedDocumentCount(self):
+        setValue(self.bulkQueue, 'addedDocumentCount', self.bulkQueue['addedDocumentCount'] + 1)
+        self.increaseTotalDocumentCount()
+
+    def increaseTotalDocumentCount(self):
+        setValue(self.bulkQueue, 'totalDocumentCount', self.bulkQueue['totalDocumentCount'] + 1)
+
+    def makeBulkJsonAndAddQueue(self, fields = []):
+        actionLine, body = self.bulkConverter['convert'](fields)
+        if actionLine is None:
+            return
+
+        self.addBulkQueueLine(actionLine)
+        if body is not None:
+            self.addBulkQueue(body)
+        self.increaseAddedDocumentCount()
+
+    def makeRequestBodyByBulkQueueAndClear(self):
+        totalDocumentCount = self.bulkQueue['totalDocumentCount']
+        log(f'[totalDocumentCount] {totalDocumentCount}')
+
+        # sender thread 로 넘기기 위해 한 번만 bytes 로 복사 (requests 는 bytes 를 그대로 전송)
+        data = bytes(self.bulkQueue['buffer'])
+        self.clearBulkQueue()
+        return data
+
+    def isCompressedFile(self):
+        return self.config['fileCompression'] != ''
+
+    def openS3ObjectStream(self, byteOffset = 0, rangeEnd = None):
+        # 압축 파일은 range 요청 대신 처음부터 압축을 풀면서 읽고, 압축 해제 기준 byteOffset 까지 건너뜀
+        if not self.isCompressedFile():
+            byteRange = f'bytes={byteOffset}-'
+            if rangeEnd is not None:
+                byteRange = byteRange + str(rangeEnd - 1)
+
+            return getS3Client().get_object(Bucket=self.config['s3Bucket'], Key=self.config['s3Key'], Range=byteRange)['Body']
+
+        streamingBody = getS3Client().get_object(Bucket=self.config['s3Bucket'], Key=self.config['s3Key'])['Body']
+        fileCompression = self.config['fileCompression']
+
+        if fileCompression == 'gz':
+            import gzip
+            stream = gzip.GzipFile(fileobj=streamingBody, mode='rb')
+        elif fileCompression == 'bz2':
+            import bz2
+            stream = bz2.BZ2File(streamingBody, mode='rb')
         else:
-            body[fieldName] = fields[fieldSeq]
+            try:
+                import zstandard
+            except ImportError:
+                raise Exception('[openS3ObjectStream] zstandard module is required for .zst file')
+            stream = zstandard.ZstdDecompressor().stream_reader(streamingBody, read_across_frames=True)
+
+        skipBytes = byteOffset
+        while skipBytes > 0:
+            skipped = len(stream.read(min(skipBytes, _s3Stream['chunkSize'])))
+            if skipped == 0:
+                break
+            skipBytes = skipBytes - skipped
+
+        return stream
+
+    def readS3ObjectBlocks(self, streamingBody, chunkSize = 0):
+        # 파일 전체를 메모리에 올리지 않고 chunk 단위로 읽어 줄바꿈으로 끝나는 block 으로 반환
+        if chunkSize <= 0:
+            chunkSize = _s3Stream['chunkSize']
+
+        remainder = b''
+        while True:
+            readStartTime = time.monotonic()
+            chunk = streamingBody.read(chunkSize)
+            self.addMetricValue('s3ReadSeconds', time.monotonic() - readStartTime)
+            if not chunk:
+                break
+
+            self.addMetricValue('inputBytes', len(chunk))
+
+            lastNewlineSeq = chunk.rfind(b'\n')
+            if lastNewlineSeq < 0:
+                remainder = remainder + chunk
+                continue
+
+            yield remainder + chunk[:lastNewlineSeq + 1]
+            remainder = chunk[lastNewlineSeq + 1:]
+
+        if remainder.strip(b'\r') != b'':
+            yield remainder
+
+    def readS3ObjectTextLines(self, streamingBody, position = {}, chunkSize = 0):
+        # block 단위로 한 번에 decode 하고 '\n' 을 포함한 line 으로 반환
+        nextBlockOffset = position['blockOffset']
+
+        for block in self.readS3ObjectBlocks(streamingBody, chunkSize):
+            text = block.decode('utf-8')
+            position['blockOffset'] = nextBlockOffset
+            position['blockText'] = text
+            position['blockIsAscii'] = (len(text) == len(block))
+            position['charOffset'] = 0
+            nextBlockOffset = nextBlockOffset + len(block)
+
+            charOffset = 0
+            for line in io.StringIO(text):
+                charOffset = charOffset + len(line)
+                position['charOffset'] = charOffset
+                yield line
+
+    def readS3ObjectRecords(self, streamingBody, position = {}, chunkSize = 0):
+        # fileQuoteChar 가 있으면 따옴표 안의 구분자, 줄바꿈, "" 를 처리하는 csv 모듈로 parse
+        lines = self.readS3ObjectTextLines(streamingBody, position, chunkSize)
+        delimiter = self.config['fileFieldDelimiter']
+        quoteChar = self.config['fileQuoteChar']
+
+        if quoteChar != '':
+            return csv.reader(lines, delimiter=delimiter, quotechar=quoteChar, doublequote=True, strict=True)
+
+        return (line.rstrip('\r\n').split(delimiter) for line in lines)
+
+    #######################################################################
+    # function - checkpoint
+    #######################################################################
+    def makeCheckpointS3Key(self):
+        return self.config['root'] + _checkpointPath + '/' + self.config['profile'] + '.' + self.config['alias'] + '.' + self.config['fileName'] + '.json'
+
+    def isCheckpointMode(self):
+        return _usable['s3'] and self.getConfigValue('checkpoint', 'enable') == True
+
+    def loadCheckpoint(self, event = {}, context = None):
+        self.checkpoint['event'] = event
+        self.checkpoint['context'] = context
+        self.checkpoint['eTag'] = ''
+        self.checkpoint['status'] = ''
+        self.checkpoint['startOffset'] = 0
+        self.checkpoint['startRecordCount'] = 0
+        self.checkpoint['deadLetterCount'] = 0
+        self.checkpoint['lastSavedTime'] = time.monotonic()
+        self.checkpoint['handedOff'] = False
+        self.fanOut['ranges'] = []
+        self.fanOut['finishedRanges'] = {}
+
+        if not self.isCheckpointMode():
+            return
+
+        self.checkpoint['eTag'] = getS3Client().head_object(Bucket=self.config['s3Bucket'], Key=self.config['s3Key'])['ETag']
+
+        try:
+            s3Object = getS3Client().get_object(Bucket=self.config['s3Bucket'], Key=self.makeCheckpointS3Key())
+        except getS3Client().exceptions.NoSuchKey:
+            return
+        except getS3Client().exceptions.ClientError as e:
+            # s3:ListBucket 권한이 없으면 없는 object 도 NoSuchKey 대신 AccessDenied
+            if e.response['Error']['Code'] not in ['AccessDenied', '403']:
+                raise
+
+            log('[loadCheckpoint] no checkpoint (AccessDenied) : ' + self.makeCheckpointS3Key())
+            return
+
+        checkpoint = json.loads(s3Object['Body'].read().decode('utf-8'))
+
+        # 같은 이름으로 다시 올라온 파일이면 이전 checkpoint 는 무시
+        if (checkpoint['eTag'] != self.checkpoint['eTag'] or checkpoint['realIndex'] != self.config['realIndex']):
+            log('[loadCheckpoint] ignore checkpoint : ' + json.dumps(checkpoint))
+            return
+
+        self.checkpoint['status'] = checkpoint['status']
+        self.checkpoint['startOffset'] = checkpoint['byteOffset']
+        self.checkpoint['startRecordCount'] = checkpoint['recordCount']
+        self.checkpoint['deadLetterCount'] = checkpoint.get('deadLetterCount', 0)
+        setValue(self.config, 'indexFieldNames', checkpoint['indexFieldNames'])
+        if 'fanOut' in checkpoint:
+            self.fanOut['ranges'] = checkpoint['fanOut']['ranges']
+            self.fanOut['finishedRanges'] = checkpoint['fanOut']['finishedRanges']
+        log('[loadCheckpoint] resume from checkpoint : ' + json.dumps(checkpoint))
+
+    def isResumedFromCheckpoint(self):
+        return self.checkpoint['status'] != ''
+
+    def isBulkFinishedByCheckpoint(self):
+        return self.checkpoint['status'] == 'bulkFinished'
+
+    def isHandedOff(self):
+        return self.checkpoint['handedOff']
+
+    def putCheckpoint(self, status, byteOffset = 0, recordCount = 0):
+        self.checkpoint['lastSavedTime'] = time.monotonic()
+
+        if not self.isCheckpointMode():
+            return
+
+        checkpoint = {
+            's3Key': self.config['s3Key'],
+            'eTag': self.checkpoint['eTag'],
+            'realIndex': self.config['realIndex'],
+            'status': status,
+            'byteOffset': byteOffset,
+            'recordCount': recordCount,
+            # 이전 invocation 까지의 색인 실패 건수, 실패가 있으면 delta sidecar 를 교체하지 않음 (putDeltaIndex 참고)
+            'deadLetterCount': self.checkpoint['deadLetterCount'] + len(self.deadLetter['items']),
+            'indexFieldNames': self.config['indexFieldNames']
+        }
 
-    addBulkQueue(header)
-    addBulkQueue(body)
-    increaseAddedDocumentCount()
+        # fan out 중이면 나눈 range 와 끝난 range 의 건수, 다시 실행하면 끝나지 않은 range 만 실행 (fanOutBulk 참고)
+        if status == 'fanOut':
+            checkpoint['fanOut'] = {
+                'ranges': self.fanOut['ranges'],
+                'finishedRanges': self.fanOut['finishedRanges']
+            }
 
+        getS3Client().put_object(Bucket=self.config['s3Bucket'], Key=self.makeCheckpointS3Key(), Body=json.dumps(checkpoint).encode('utf-8'))
+        log('[putCheckpoint] ' + json.dumps(checkpoint))
 
-def makeRequestBodyByBulkQueueAndClear():
-    totalDocumentCount = _bulkQueue['totalDocumentCount']
-    log(f'[totalDocumentCount] {totalDocumentCount}')
+    def deleteCheckpoint(self):
+        if not self.isCheckpointMode():
+            return
 
-    data = '\n'.join(_bulkQueue['queue']) + '\n'
-    clearBulkQueue()
-    return data
+        getS3Client().delete_object(Bucket=self.config['s3Bucket'], Key=self.makeCheckpointS3Key())
 
-###########################################################################
-# function - Elasticsearch
-###########################################################################
-def createIndex():
-    alias = _config['alias']
-    indexName = _config['realIndex']
+    def isCheckpointTime(self):
+        if not self.isCheckpointMode():
+            return False
 
-    indexScheme = {}
-    indexScheme['mappings'] = _config['indexMappings']['mappings']
-    indexScheme['settings'] = _elasticsearch[_config['profile']]['indexSettings']['settings']
+        return time.monotonic() - self.checkpoint['lastSavedTime'] >= float(self.getConfigValue('checkpoint', 'intervalSeconds'))
 
-    if 'analysis' in _config['indexAnalysis']:
-        indexScheme['settings']['analysis'] = _config['indexAnalysis']['analysis']
+    def isHandoffTime(self):
+        context = self.checkpoint['context']
+        if not self.isCheckpointMode() or context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+            return False
 
-    if (isNotCreateIndex() or alias == indexName):
-        log(json.dumps(indexScheme))
-        return
+        return context.get_remaining_time_in_millis() < int(self.getConfigValue('checkpoint', 'handoffRemainingMillis'))
 
-    log(f'[createIndex] : start, indexName : {indexName}')
+    def checkpointBulk(self, byteOffset = 0, recordCount = 0):
+        # 전송 중인 batch 를 모두 기다려서 byteOffset 까지 색인 완료된 것을 보장한 후 저장
+        self.stopBulkSenders()
+        self.putCheckpoint('bulk', byteOffset, recordCount)
 
-    url = makeElasticsearchUrl(indexName)
-    response = requests.put(url, data=json.dumps(indexScheme), headers=_elasticsearch['headers'])
-    log(f'[createIndex] {url}, ' + response.text)
-    response.raise_for_status()
-    return response.text
+        if self.isHandoffTime():
+            self.handoff()
+            return
 
-def postForBulk():
-    if isEmptyBulkQueue():
-        return 'bulk queue is empty'
+        self.startBulkSenders()
 
-    requestBody = makeRequestBodyByBulkQueueAndClear()
+    def handoff(self):
+        context = self.checkpoint['context']
+        log('[handoff] invoke ' + context.function_name)
 
-    if (_usable['elasticsearch'] == False):
-        return 'elasticsearch usable : False'
+        import boto3
+        # 같은 alias 의 뒤 job 이 있으면 같이 넘겨서 이 파일이 끝난 후 실행되도록 (runJobGroups 참고)
+        event = self.checkpoint['event']
+        boto3.client('lambda').invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps({'Records': event['Records'] + event.get('nextRecords', [])}).encode('utf-8'))
+
+        self.checkpoint['handedOff'] = True
+
+    #######################################################################
+    # function - delta
+    #######################################################################
+    def isDeltaMode(self):
+        return _usable['s3'] and self.getConfigValue('delta', 'enable') == True and not self.isFanOutWorker()
+
+    def makeDeltaS3Key(self):
+        return self.config['root'] + _deltaPath + '/' + self.config['profile'] + '.' + self.config['alias'] + '.idx'
+
+    def makeDeltaTmpFilePath(self, name = ''):
+        return self.delta['tmpPath'] + '/delta.' + self.config['profile'] + '.' + self.config['alias'] + '.' + name
+
+    def clearDelta(self):
+        if self.delta['indexFilePath'] != '' and os.path.exists(self.delta['indexFilePath']):
+            os.remove(self.delta['indexFilePath'])
+
+        self.delta['changedRows'] = None
+        self.delta['indexFilePath'] = ''
+        self.delta['skippedCount'] = 0
+
+    def makeDeltaHasher(self, fieldNames = []):
+        # 컬럼, mapping, 배열 설정이 바뀌면 모든 row 의 hash 가 바뀌도록 함께 넣음
+        import hashlib
+
+        hasher = hashlib.blake2b(digest_size=self.delta['hashBytes'])
+        hasher.update(json.dumps([fieldNames, self.config['indexMappings'], self.config['fieldArrayDelimiter'], self.config['arrayFieldNames']], sort_keys=True).encode('utf-8'))
+        return hasher
+
+    def readDeltaRecords(self, file, hasRowSeq = False):
+        # (idBytes, rowKey, rowHash), rowKey 는 row 번호 * 2 + 부분 update 여부, sidecar 는 rowKey 가 없으므로 0
+        import struct
+
+        hashBytes = self.delta['hashBytes']
+        while True:
+            idLength = file.read(2)
+            if len(idLength) < 2:
+                return
+
+            idBytes = file.read(struct.unpack('>H', idLength)[0])
+            rowSeq = struct.unpack('>Q', file.read(8))[0] if hasRowSeq else 0
+            yield idBytes, rowSeq, file.read(hashBytes)
+
+    def writeDeltaRun(self, records = []):
+        # (idBytes, rowKey, rowHash) 를 정렬해서 /tmp 에 저장, 같은 _id 는 파일 안의 순서대로
+        records.sort()
+        path = self.makeDeltaTmpFilePath('run' + str(time.monotonic_ns()))
+
+        with open(path, 'wb') as file:
+            for idBytes, rowKey, rowHash in records:
+                writeDeltaRecord(file, idBytes, rowHash, rowKey)
+
+        records.clear()
+        return path
+
+    def downloadDeltaIndex(self):
+        # 이전 sidecar 를 /tmp 로 내려받음, 없으면 (첫 색인) None
+        path = self.makeDeltaTmpFilePath('previous')
+
+        try:
+            streamingBody = getS3Client().get_object(Bucket=self.config['s3Bucket'], Key=self.makeDeltaS3Key())['Body']
+        except getS3Client().exceptions.NoSuchKey:
+            return None
+
+        with open(path, 'wb') as file:
+            for chunk in iter(lambda: streamingBody.read(_s3Stream['chunkSize']), b''):
+                file.write(chunk)
+
+        return path
+
+    def makeDeltaIndex(self):
+        # 1 pass : 파일의 (_id, row 번호, row hash) 를 정렬된 run 으로 /tmp 에 쓰고 이전 sidecar 와 merge 해서
+        # 바뀐 row 번호 bitmap 과 새 sidecar 를 만듦, bulk() 는 2 pass 에서 bitmap 에 없는 row 를 건너뜀
+        # dedup 도 켜져 있으면 같은 merge 에서 _id 별 마지막 row 를 골라 keptRows 를 만듦 (makeDedupIndex 는 건너뜀)
+        import heapq
+        import itertools
+
+        self.clearDelta()
+        if not self.isDeltaMode():
+            return
+
+        s3Stream = self.openS3ObjectStream()
+        records = self.readS3ObjectRecords(s3Stream, makeStreamPosition())
+        fieldNames = next(records, None)
+        if fieldNames is None:
+            raise Exception('[makeDeltaIndex] empty file : ' + self.config['s3Key'])
+
+        baseHasher = self.makeDeltaHasher(fieldNames)
+        operationSeq = self.findRowOperationFieldSeq(fieldNames)
+        defaultOperation = self.getConfigValue('rowOperation', 'default')
+        deletedHash = self.delta['deletedHash']
+        maxRunRecords = int(self.getConfigValue('delta', 'maxRunRecords'))
+        runPaths = []
+        runRecords = []
+        unknownRowSeqs = []
+        recordCount = 1
+
+        try:
+            for fields in records:
+                recordCount = recordCount + 1
+                operation = getRowOperation(fields, operationSeq, defaultOperation)
+                rowKey = recordCount * 2 + isPartialRowOperation(operation)
+
+                # 모르는 operation 은 비교하지 않고 bulk 에서 dead letter 되도록 항상 보냄 (compileBulkConverter 참고)
+                if operation not in _rowOperations:
+                    unknownRowSeqs.append(recordCount)
+                    continue
+
+                if operation == 'delete':
+                    runRecords.append((fields[0].encode('utf-8'), rowKey, deletedHash))
+                    continue
+
+                hasher = baseHasher.copy()
+                hasher.update('\x1f'.join(fields).encode('utf-8'))
+                runRecords.append((fields[0].encode('utf-8'), rowKey, hasher.digest()))
+
+                if len(runRecords) >= maxRunRecords:
+                    runPaths.append(self.writeDeltaRun(runRecords))
+
+            runPaths.append(self.writeDeltaRun(runRecords))
+
+            # create 는 모든 row 를 색인하고 sidecar 만 새로 만듦
+            previousPath = None
+            if self.isNotCreateIndex():
+                previousPath = self.downloadDeltaIndex()
+            if previousPath is not None:
+                runPaths.append(previousPath)
+
+            changedRows = bytearray(recordCount // 8 + 1)
+            keptRows = bytearray(recordCount // 8 + 1) if self.isDedupMode() else None
+            indexFilePath = self.makeDeltaTmpFilePath('next')
+            runFiles = [open(path, 'rb') for path in runPaths]
+
+            try:
+                runs = [self.readDeltaRecords(file, path != previousPath) for file, path in zip(runFiles, runPaths)]
+                with open(indexFilePath, 'wb') as indexFile:
+                    # 이전 sidecar 의 record 는 rowKey 가 0 이라 같은 _id 중 가장 먼저 나옴
+                    for idBytes, group in itertools.groupby(heapq.merge(*runs), key=lambda record: record[0]):
+                        rows = list(group)
+                        lastFullSeq = 0
+                        if keptRows is not None:
+                            lastFullSeq = max([rowKey >> 1 for idBytes, rowKey, rowHash in rows if rowKey > 0 and not rowKey & 1], default=0)
+
+                        lastHash = None
+                        for idBytes, rowKey, rowHash in rows:
+                            rowSeq = rowKey >> 1
+                            if rowSeq > 0:
+                                # dedup : 뒤에 같은 _id 의 전체 row 가 있으면 부분 update 도 덮어쓰므로 건너뜀, 비교 기준 hash 도 바꾸지 않음
+                                if rowSeq < lastFullSeq:
+                                    continue
+                                if keptRows is not None:
+                                    setRowBit(keptRows, rowSeq)
+                                # delete 는 항상 보내고 sidecar 에서 _id 를 뺌
+                                if rowHash != lastHash or rowHash == deletedHash:
+                                    setRowBit(changedRows, rowSeq)
+                            lastHash = rowHash
+
+                        if lastHash != deletedHash:
+                            writeDeltaRecord(indexFile, idBytes, lastHash)
+            finally:
+                for file in runFiles:
+                    file.close()
+
+            for rowSeq in unknownRowSeqs:
+                setRowBit(changedRows, rowSeq)
+                if keptRows is not None:
+                    setRowBit(keptRows, rowSeq)
+        finally:
+            s3Stream.close()
+            for path in runPaths:
+                os.remove(path)
+
+        self.delta['indexFilePath'] = indexFilePath
+        self.dedup['keptRows'] = keptRows
+        if self.isNotCreateIndex():
+            self.delta['changedRows'] = changedRows
+
+        log(f'[makeDeltaIndex] records : {recordCount - 1}, runs : {len(runPaths)}, previous : {previousPath is not None}')
+
+    def isDeltaSkippedRow(self, recordCount = 0):
+        if self.delta['changedRows'] is None:
+            return False
+
+        return not hasRowBit(self.delta['changedRows'], recordCount)
+
+    def getDeadLetterIds(self):
+        # dead letter 의 _id, _id 가 없는 document (autoGenerateId) 가 있으면 None
+        failedIds = set()
+        for item in self.deadLetter['items']:
+            failedId = next(iter(json.loads(item[0]).values())).get('_id')
+            if failedId is None:
+                return None
+            failedIds.add(failedId.encode('utf-8'))
+
+        return failedIds
+
+    def removeDeltaRecords(self, failedIds = set()):
+        # 색인에 실패한 _id 를 sidecar 에서 빼서 다음 파일에서 바뀐 row 로 다시 보내도록 함
+        indexFilePath = self.makeDeltaTmpFilePath('retained')
+
+        with open(self.delta['indexFilePath'], 'rb') as file, open(indexFilePath, 'wb') as indexFile:
+            for idBytes, rowKey, rowHash in self.readDeltaRecords(file):
+                if idBytes not in failedIds:
+                    writeDeltaRecord(indexFile, idBytes, rowHash)
+
+        os.remove(self.delta['indexFilePath'])
+        self.delta['indexFilePath'] = indexFilePath
+
+    def putDeltaIndex(self):
+        # 색인이 끝난 후에만 sidecar 교체, 중간에 실패하면 이전 sidecar 기준으로 다시 비교
+        if self.delta['indexFilePath'] == '':
+            return
+
+        # 실패한 document 가 색인된 것으로 기록되면 같은 row 를 다시 보내도 건너뛰게 되므로
+        # 실패한 _id 를 모르면 (이전 invocation 의 실패, _id 없는 document) 이전 sidecar 를 그대로 둠
+        failedIds = self.getDeadLetterIds()
+        if self.checkpoint['deadLetterCount'] > 0 or failedIds is None:
+            log('[putDeltaIndex] keep previous sidecar, failed documents : ' + str(self.checkpoint['deadLetterCount'] + len(self.deadLetter['items'])))
+            self.clearDelta()
+            return
+
+        if len(failedIds) > 0:
+            self.removeDeltaRecords(failedIds)
+            log(f'[putDeltaIndex] removed failed _id : {len(failedIds)}')
+
+        with open(self.delta['indexFilePath'], 'rb') as file:
+            getS3Client().put_object(Bucket=self.config['s3Bucket'], Key=self.makeDeltaS3Key(), Body=file)
+
+        log('[putDeltaIndex] ' + self.config['s3Bucket'] + ':' + self.makeDeltaS3Key())
+        self.clearDelta()
+
+    #######################################################################
+    # function - dedup
+    #######################################################################
+    def isDedupMode(self):
+        return _usable['s3'] and self.getConfigValue('dedup', 'enable') == True and not self.isFanOutWorker()
+
+    def clearDedup(self):
+        self.dedup['keptRows'] = None
+
+    def makeDedupRecords(self, lastRows = {}, partialRows = []):
+        # (_id hash, rowKey) 를 정렬, rowKey 는 row 번호 * 2 + 부분 update 여부
+        records = [(key, rowSeq * 2) for key, rowSeq in lastRows.items()] + partialRows
+        records.sort()
+
+        lastRows.clear()
+        partialRows.clear()
+        return records
+
+    def writeDedupRun(self, lastRows = {}, partialRows = []):
+        # 정렬한 (_id hash, rowKey) 를 /tmp 에 저장
+        import struct
+
+        path = self.dedup['tmpPath'] + '/dedup.' + self.config['profile'] + '.' + self.config['alias'] + '.run' + str(time.monotonic_ns())
+        with open(path, 'wb') as file:
+            for key, rowKey in self.makeDedupRecords(lastRows, partialRows):
+                file.write(key)
+                file.write(struct.pack('>Q', rowKey))
+
+        return path
+
+    def readDedupRun(self, file):
+        import struct
+
+        keyBytes = self.dedup['keyBytes']
+        while True:
+            record = file.read(keyBytes + 8)
+            if len(record) < keyBytes + 8:
+                return
+
+            yield record[:keyBytes], struct.unpack('>Q', record[keyBytes:])[0]
+
+    def setDedupKeptRows(self, keptRows, records):
+        # _id 별 마지막 전체 row (index, delete) 와 그 뒤의 부분 update 만 남김
+        # 앞의 row 는 전체 row 든 부분 update 든 마지막 전체 row 가 덮어쓰므로 건너뛰어도 결과가 같음
+        import itertools
+
+        for key, group in itertools.groupby(records, key=lambda record: record[0]):
+            rowKeys = [rowKey for key, rowKey in group]
+            lastFullSeq = max([rowKey >> 1 for rowKey in rowKeys if not rowKey & 1], default=0)
+            for rowKey in rowKeys:
+                if rowKey >> 1 >= lastFullSeq:
+                    setRowBit(keptRows, rowKey >> 1)
+
+    def makeDedupIndex(self):
+        # 1 pass : _id 별 마지막 전체 row (index, delete) 번호와 부분 update 의 row 번호로 keptRows bitmap 을 만듦
+        import hashlib
+        import heapq
+
+        # delta 가 켜져 있으면 makeDeltaIndex 의 merge 에서 함께 처리
+        if self.isDeltaMode():
+            return
+
+        self.clearDedup()
+        if not self.isDedupMode():
+            return
+
+        s3Stream = self.openS3ObjectStream()
+        records = self.readS3ObjectRecords(s3Stream, makeStreamPosition())
+        fieldNames = next(records, None)
+        if fieldNames is None:
+            raise Exception('[makeDedupIndex] empty file : ' + self.config['s3Key'])
+
+        operationSeq = self.findRowOperationFieldSeq(fieldNames)
+        defaultOperation = self.getConfigValue('rowOperation', 'default')
+        keyBytes = self.dedup['keyBytes']
+        maxMemoryKeys = int(self.getConfigValue('dedup', 'maxMemoryKeys'))
+        keptRows = bytearray()
+        lastRows = {}
+        partialRows = []
+        runPaths = []
+        recordCount = 1
+
+        try:
+            for fields in records:
+                recordCount = recordCount + 1
+
+                # _id 대신 고정 길이 hash 를 key 로 써서 memory 를 줄임
+                key = hashlib.blake2b(fields[0].encode('utf-8'), digest_size=keyBytes).digest()
+                operation = getRowOperation(fields, operationSeq, defaultOperation)
+                # 모르는 operation 은 bulk 에서 dead letter 되도록 항상 보냄 (compileBulkConverter 참고)
+                if operation not in _rowOperations:
+                    setRowBit(keptRows, recordCount)
+                elif isPartialRowOperation(operation):
+                    partialRows.append((key, recordCount * 2 + 1))
+                else:
+                    lastRows[key] = recordCount
+
+                if len(lastRows) + len(partialRows) >= maxMemoryKeys:
+                    runPaths.append(self.writeDedupRun(lastRows, partialRows))
+
+            if len(runPaths) == 0:
+                self.setDedupKeptRows(keptRows, self.makeDedupRecords(lastRows, partialRows))
+            else:
+                runPaths.append(self.writeDedupRun(lastRows, partialRows))
+                runFiles = [open(path, 'rb') for path in runPaths]
+                try:
+                    self.setDedupKeptRows(keptRows, heapq.merge(*[self.readDedupRun(file) for file in runFiles]))
+                finally:
+                    for file in runFiles:
+                        file.close()
+        finally:
+            s3Stream.close()
+            for path in runPaths:
+                os.remove(path)
+
+        self.dedup['keptRows'] = keptRows
+        log(f'[makeDedupIndex] records : {recordCount - 1}, keptRecords : {countRowBits(keptRows)}, runs : {len(runPaths)}')
+
+    def isDedupSkippedRow(self, recordCount = 0):
+        if self.dedup['keptRows'] is None:
+            return False
+
+        return not hasRowBit(self.dedup['keptRows'], recordCount)
+
+    #######################################################################
+    # function - fan out
+    #######################################################################
+    def isFanOutWorker(self):
+        return self.fanOut['role'] == 'worker'
+
+    def isFanOutMode(self):
+        if (_usable['s3'] == False or self.getConfigValue('fanOut', 'enable') != True):
+            return False
+
+        # 압축 파일은 중간부터 읽을 수 없음
+        if self.isCompressedFile():
+            return False
+
+        # quote 안의 줄바꿈은 line 이 아니지만 range 는 줄바꿈 위치에서 나누므로 quote 를 쓰는 파일은 나눌 수 없음
+        if self.config['fileQuoteChar'] != '':
+            return False
+
+        # checkpoint 로 이어서 하는 경우는 fan out 중에 멈춘 경우만 fan out 으로 (남은 range 만 실행)
+        if self.isResumedFromCheckpoint():
+            return self.checkpoint['status'] == 'fanOut'
+
+        # delta, dedup 은 파일 전체의 row 번호 기준이라 범위로 나눌 수 없음
+        if self.isDeltaMode() or self.isDedupMode():
+            return False
+
+        objectSize = getS3Client().head_object(Bucket=self.config['s3Bucket'], Key=self.config['s3Key'])['ContentLength']
+        return objectSize >= int(self.getConfigValue('fanOut', 'minBytes'))
+
+    def readHeaderLine(self):
+        s3Object = getS3Client().get_object(Bucket=self.config['s3Bucket'], Key=self.config['s3Key'])
+        position = makeStreamPosition()
+
+        for fields in self.readS3ObjectRecords(s3Object['Body'], position, self.fanOut['probeBytes']):
+            s3Object['Body'].close()
+            return fields, getStreamByteOffset(position)
+
+        raise Exception('[readHeaderLine] empty file : ' + self.config['s3Key'])
+
+    def findNextLineStart(self, offset, objectSize):
+        # offset 이후 첫 줄바꿈 다음 위치 (line 중간에서 range 가 나뉘지 않도록)
+        while offset < objectSize:
+            probeEnd = min(objectSize, offset + self.fanOut['probeBytes']) - 1
+            s3Object = getS3Client().get_object(Bucket=self.config['s3Bucket'], Key=self.config['s3Key'], Range=f'bytes={offset}-{probeEnd}')
+            data = s3Object['Body'].read()
+
+            newlineSeq = data.find(b'\n')
+            if newlineSeq >= 0:
+                return offset + newlineSeq + 1
+
+            offset = offset + len(data)
+
+        return objectSize
+
+    def makeFanOutRanges(self, dataStart, objectSize):
+        rangeBytes = int(self.getConfigValue('fanOut', 'rangeBytes'))
+
+        # checkpoint 가 없으면 끝난 range 를 기록할 수 없으므로 한 번에 (maxWorkers 개 이하로) 모두 실행되도록 range 를 늘림
+        if not self.isCheckpointMode():
+            maxWorkers = int(self.getConfigValue('fanOut', 'maxWorkers'))
+            minRangeBytes = -(-(objectSize - dataStart) // maxWorkers)
+            if minRangeBytes > rangeBytes:
+                log(f'[makeFanOutRanges] rangeBytes {rangeBytes} -> {minRangeBytes}, maxWorkers : {maxWorkers}')
+                rangeBytes = minRangeBytes
+
+        boundaries = [dataStart]
+        cut = dataStart + rangeBytes
+        while cut < objectSize:
+            lineStart = self.findNextLineStart(cut, objectSize)
+            if lineStart > boundaries[-1]:
+                boundaries.append(lineStart)
+            cut = max(lineStart, cut) + rangeBytes
+
+        if boundaries[-1] < objectSize:
+            boundaries.append(objectSize)
+
+        return [[boundaries[seq], boundaries[seq + 1]] for seq in range(len(boundaries) - 1)]
+
+    def makeFanOutWorkerEvents(self, event, ranges = [], rangeSeqs = []):
+        workerEvents = []
+        for rangeSeq in rangeSeqs:
+            workerEvent = {
+                'Records': event['Records'],
+                'fanOut': {
+                    'rangeSeq': rangeSeq,
+                    'rangeStart': ranges[rangeSeq][0],
+                    'rangeEnd': ranges[rangeSeq][1],
+                    'indexFieldNames': self.config['indexFieldNames']
+                }
+            }
+            workerEvents.append(workerEvent)
+
+        return workerEvents
+
+    def fanOutBulk(self, context = None):
+        indexName = self.config['realIndex']
+        objectSize = getS3Client().head_object(Bucket=self.config['s3Bucket'], Key=self.config['s3Key'])['ContentLength']
+
+        fields, dataStart = self.readHeaderLine()
+        self.headerValidate(fields)
+        setValue(self.config, 'indexFieldNames', fields)
+
+        # checkpoint 로 이어서 하면 이전 invocation 이 나눈 range 를 그대로 사용 (createIndex 는 건너뜀)
+        if self.checkpoint['status'] != 'fanOut':
+            self.fanOut['ranges'] = self.makeFanOutRanges(dataStart, objectSize)
+            self.fanOut['finishedRanges'] = {}
+            self.putCheckpoint('fanOut', dataStart, 1)
+
+        ranges = self.fanOut['ranges']
+        finishedRanges = self.fanOut['finishedRanges']
+        pendingRangeSeqs = [rangeSeq for rangeSeq in range(len(ranges)) if str(rangeSeq) not in finishedRanges]
+        backend = self.getConfigValue('fanOut', 'backend')
+        maxWorkers = int(self.getConfigValue('fanOut', 'maxWorkers'))
+        log(f'[fanOutBulk] : start, indexName : {indexName}, objectSize : {objectSize}, ranges : {len(ranges)}, pending : {len(pendingRangeSeqs)}, backend : {backend}')
+
+        def finishRange(result):
+            log('[fanOutBulk] worker result : ' + json.dumps(result))
+            finishedRanges[str(result['rangeSeq'])] = result['recordCount']
+            self.addMetricValue('documentCount', result['recordCount'])
+            self.putCheckpoint('fanOut', dataStart, 1)
+
+        # coordinator 도 worker 를 기다리는 동안 lambda timeout 안에 있으므로 invocation 마다 maxWorkers 개씩만 실행
+        # 남은 range 는 handoff 한 invocation 이 checkpoint 로 이어서 실행 (checkpoint 가 없으면 range 가 maxWorkers 개 이하)
+        while len(pendingRangeSeqs) > 0:
+            workerEvents = self.makeFanOutWorkerEvents(self.checkpoint['event'], ranges, pendingRangeSeqs[:maxWorkers])
+            _fanOutBackends[backend](workerEvents, context, maxWorkers, finishRange)
+            pendingRangeSeqs = pendingRangeSeqs[maxWorkers:]
+
+            if len(pendingRangeSeqs) > 0 and backend == 'lambda':
+                self.handoff()
+                return
+
+        recordCount = sum(finishedRanges.values())
+
+        # coordinator 는 header 만 읽으므로 처리량은 파일 전체 크기 기준
+        self.setMetricValue('inputBytes', objectSize)
+        self.setMetricValue('fanOutRangeCount', len(ranges))
+        self.putCheckpoint('bulkFinished', objectSize, recordCount + 1)
+        self.sendMessage('count', '데이터 ' + str(recordCount) + '건이 등록되었습니다.')
+
+    def runFanOutWorker(self, event, context = None):
+        # coordinator 가 header, 색인 생성을 끝낸 뒤 호출, 에러는 coordinator 로 전달되도록 raise
+        rangeInfo = event['fanOut']
+        self.fanOut['role'] = 'worker'
+        self.fanOut['rangeEnd'] = rangeInfo['rangeEnd']
+        self.resetMetrics()
+        status = 'error'
+
+        try:
+            self.initConfig(event)
+            self.setElasticsearchRequestHeader()
+            setValue(self.config, 'indexFieldNames', rangeInfo['indexFieldNames'])
+
+            self.checkpoint['event'] = event
+            self.checkpoint['context'] = None
+            self.checkpoint['status'] = ''
+            self.checkpoint['startOffset'] = rangeInfo['rangeStart']
+            self.checkpoint['startRecordCount'] = 1
+
+            recordCount = self.runPhase('bulk', self.bulk)
+            status = 'success'
+        except Exception as e:
+            log('[runFanOutWorker] Exception : ' + str(e))
+            self.sendMessage('error', f'{rangeInfo["rangeSeq"]} 번째 범위 색인 중 에러가 발생되었습니다.\n' + str(e))
+            raise
+        finally:
+            self.emitMetrics(status)
+            drainSlackMessages()
+
+        return {
+            'rangeSeq': rangeInfo['rangeSeq'],
+            'rangeStart': rangeInfo['rangeStart'],
+            'rangeEnd': rangeInfo['rangeEnd'],
+            'recordCount': recordCount
+        }
 
-    response = requests.post(makeElasticsearchUrl('_bulk'), data=requestBody, headers=_elasticsearch['headers'])
-    response.raise_for_status()
-    return response.text
+    #######################################################################
+    # function - metrics
+    #######################################################################
+    def resetMetrics(self):
+        with self.metrics['lock']:
+            self.metrics['startTime'] = time.monotonic()
+            self.metrics['phaseSeconds'] = {}
+            self.metrics['values'] = {}
+            self.metrics['latencyCounts'] = [0] * (len(self.metrics['latencyBounds']) + 1)
+
+    def runPhase(self, name, function, *args):
+        # 에러가 나도 그 phase 까지의 시간은 남도록 finally 에서 기록
+        startTime = time.monotonic()
+        try:
+            return function(*args)
+        finally:
+            self.metrics['phaseSeconds'][name] = self.metrics['phaseSeconds'].get(name, 0.0) + time.monotonic() - startTime
+
+    def addMetricValue(self, name, value = 0):
+        # sender thread 에서도 호출
+        with self.metrics['lock']:
+            self.metrics['values'][name] = self.metrics['values'].get(name, 0) + value
+
+    def setMetricValue(self, name, value = 0):
+        with self.metrics['lock']:
+            self.metrics['values'][name] = value
+
+    def addBulkLatencyMetric(self, latency, requestBytes = 0):
+        import bisect
+
+        with self.metrics['lock']:
+            values = self.metrics['values']
+            values['bulkBatchCount'] = values.get('bulkBatchCount', 0) + 1
+            values['bulkRequestBytes'] = values.get('bulkRequestBytes', 0) + requestBytes
+            values['bulkRequestSeconds'] = values.get('bulkRequestSeconds', 0.0) + latency
+            values['bulkBatchLatencyMax'] = max(values.get('bulkBatchLatencyMax', 0.0), latency)
+            self.metrics['latencyCounts'][bisect.bisect_left(self.metrics['latencyBounds'], latency)] += 1
+
+    def emitMetrics(self, status = ''):
+        # CloudWatch Logs 가 stdout 의 EMF json 을 metric 으로 추출, 별도 API 호출 없음
+        with self.metrics['lock']:
+            phaseSeconds = dict(self.metrics['phaseSeconds'])
+            values = dict(self.metrics['values'])
+            latencyCounts = list(self.metrics['latencyCounts'])
+
+        record = {
+            'Profile': self.config['profile'],
+            'Action': self.config['action'],
+            'Role': 'worker' if self.isFanOutWorker() else 'main',
+            'Alias': self.config['alias'],
+            'Index': self.config['realIndex'],
+            'S3Key': self.config['s3Key'],
+            'Status': status
+        }
+        metrics = []
 
-def bulk():
-    indexName = _config['realIndex']
-    log(f'[bulk] : start, indexName : {indexName}')
+        def putMetric(name, value, unit):
+            record[name] = value
+            metrics.append({'Name': name, 'Unit': unit})
 
-    if (_usable['s3'] == False):
-        return
+        putMetric('TotalSeconds', round(time.monotonic() - self.metrics['startTime'], 3), 'Seconds')
+        for name, seconds in phaseSeconds.items():
+            putMetric(makeMetricName(name) + 'Seconds', round(seconds, 3), 'Seconds')
 
-    s3Object = _s3Client.get_object(Bucket=_config['s3Bucket'], Key=_config['s3Key'])
-    recordLine = s3Object["Body"].read()
+        bulkSeconds = phaseSeconds.get('bulk', 0.0)
+        if 'bulk' in phaseSeconds and 'fanOutRangeCount' not in values:
+            # parse (csv 분리 + 직렬화) 시간은 bulk 에서 S3 읽기, sender 대기 시간을 뺀 값
+            parseSeconds = bulkSeconds - values.get('s3ReadSeconds', 0.0) - values.get('bulkSenderWaitSeconds', 0.0)
+            putMetric('ParseSeconds', round(max(0.0, parseSeconds), 3), 'Seconds')
 
-    recordCount = 0
-    for line in recordLine.splitlines():
-        recordCount = recordCount + 1
-        record = line.decode('utf-8')
+        for name in ['s3ReadSeconds', 'bulkSenderWaitSeconds', 'bulkRequestSeconds', 'bulkBatchLatencyMax']:
+            if name in values:
+                putMetric(makeMetricName(name), round(values[name], 3), 'Seconds')
 
-        fields = record.split(_config['fileFieldDelimiter'])
+        for name in ['documentCount', 'bulkBatchCount', 'bulkRetryCount', 'retriedDocumentCount', 'deadLetterCount']:
+            putMetric(makeMetricName(name), values.get(name, 0), 'Count')
 
-        if (recordCount == 1):
-            headerValidate(fields)
-            setValue(_config, 'indexFieldNames', fields)
-        else:
-            makeBulkJsonAndAddQueue(fields)
+        for name in ['fanOutRangeCount', 'deltaSkippedCount', 'dedupSkippedCount']:
+            if name in values:
+                putMetric(makeMetricName(name), values[name], 'Count')
 
-            if isFullBulkQueue():
-                postForBulk()
+        for name in ['inputBytes', 'bulkRequestBytes']:
+            putMetric(makeMetricName(name), values.get(name, 0), 'Bytes')
 
-    postForBulk()
-    sendMessage('count', '데이터 ' + str(recordCount-1) + '건이 등록되었습니다.')
+        if bulkSeconds > 0:
+            putMetric('DocumentsPerSecond', round(values.get('documentCount', 0) / bulkSeconds, 1), 'Count/Second')
+            putMetric('InputBytesPerSecond', round(values.get('inputBytes', 0) / bulkSeconds, 1), 'Bytes/Second')
 
-def getAliasBindedIndex():
-    if (_usable['elasticsearch'] == False):
-        return ''
+        if values.get('bulkBatchCount', 0) > 0:
+            putMetric('BulkBatchLatencyAvg', round(values['bulkRequestSeconds'] / values['bulkBatchCount'], 3), 'Seconds')
 
-    alias = _config['alias']
+        putMetric('PeakRss', getPeakRssKilobytes(), 'Kilobytes')
 
-    url = makeElasticsearchUrl(f'_cat/aliases/{alias}?format=json')
-    response = requests.get(url, headers=_elasticsearch['headers'])
-    log(f'[getAliasBindedIndex] {url}, ' + response.text)
-    response.raise_for_status()
+        # 마지막 count 는 가장 큰 bound 를 넘은 요청 수
+        record['BulkBatchLatencyHistogram'] = {
+            'bounds': self.metrics['latencyBounds'],
+            'counts': latencyCounts
+        }
+        record['_aws'] = {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': self.metrics['namespace'],
+                'Dimensions': [['Profile', 'Action', 'Role']],
+                'Metrics': metrics
+            }]
+        }
 
-    bindedIndices = json.loads(response.text)
+        # log() 의 prefix 가 붙으면 EMF 로 인식되지 않으므로 json 만 출력
+        print(json.dumps(record, ensure_ascii=False))
 
-    if (len(bindedIndices) > 1):
-        raise Exception(f'{alias} is multi indices binded')
-    elif (len(bindedIndices) == 0):
-        return ''
+    #######################################################################
+    # function - bulk sender
+    #######################################################################
+    def startBulkSenders(self):
+        # queue 크기를 제한해서 전송이 밀리면 parse 가 대기하도록 (backpressure)
+        self.bulkSender['queue'] = queue.Queue(maxsize=self.bulkQueue['maxPendingBatches'])
+        self.bulkSender['errors'] = []
+        self.bulkSender['workers'] = []
 
-    return bindedIndices[0]['index']
+        for seq in range(self.bulkQueue['senderCount']):
+            worker = threading.Thread(target=self.bulkSenderWorker, name=f'bulk-sender-{seq}', daemon=True)
+            worker.start()
+            self.bulkSender['workers'].append(worker)
 
-def setNotDeleteIndicies(indices = []):
-    setValue(_config, 'notDeleteIndicies', indices)
+    def bulkSenderWorker(self):
+        senderQueue = self.bulkSender['queue']
 
-def rebindAlias():
-    alias = _config['alias']
-    indexName = _config['realIndex']
-    bindedIndexName = getAliasBindedIndex()
+        while True:
+            requestBody = senderQueue.get()
+            if requestBody is None:
+                return
 
-    if (isNotCreateIndex() or alias == indexName):
-        return ''
+            # 에러 이후에도 queue 는 계속 비워야 producer 가 put 에서 멈추지 않음
+            if len(self.bulkSender['errors']) > 0:
+                continue
 
-    setNotDeleteIndicies([indexName, bindedIndexName])
+            try:
+                self.sendBulkRequest(requestBody)
+            except Exception as e:
+                self.bulkSender['errors'].append(e)
 
-    log(f'[rebindAlias] : start, alias : {alias}, bindedIndexName : {bindedIndexName}, indexName : {indexName}, ')
+    def isRunningBulkSenders(self):
+        return len(self.bulkSender['workers']) > 0
 
-    requestBody = {
-        'actions': []
-    }
+    def raiseBulkSenderError(self):
+        if len(self.bulkSender['errors']) > 0:
+            raise self.bulkSender['errors'][0]
 
-    if (bindedIndexName != ''):
-        remove = {
-            'remove': {
-                'alias': alias,
-                'index': bindedIndexName
+    def submitBulkRequest(self, requestBody):
+        self.raiseBulkSenderError()
+
+        # sender 가 밀려서 parse 가 기다린 시간
+        waitStartTime = time.monotonic()
+        self.bulkSender['queue'].put(requestBody)
+        self.addMetricValue('bulkSenderWaitSeconds', time.monotonic() - waitStartTime)
+
+    def stopBulkSenders(self):
+        if not self.isRunningBulkSenders():
+            return
+
+        waitStartTime = time.monotonic()
+        for worker in self.bulkSender['workers']:
+            self.bulkSender['queue'].put(None)
+
+        for worker in self.bulkSender['workers']:
+            worker.join()
+        self.addMetricValue('bulkSenderWaitSeconds', time.monotonic() - waitStartTime)
+
+        self.bulkSender['workers'] = []
+        self.bulkSender['queue'] = None
+        self.raiseBulkSenderError()
+
+    #######################################################################
+    # function - bulk throttle
+    #######################################################################
+    def resetBulkThrottle(self):
+        with self.bulkThrottle['condition']:
+            self.bulkThrottle['batchBytes'] = max(self.bulkQueue['minQueueBytes'], self.bulkQueue['maxQueueBytes'] // 2)
+            self.bulkThrottle['inFlightWindow'] = float(max(self.bulkQueue['minSenderCount'], self.bulkQueue['senderCount'] // 2))
+            self.bulkThrottle['activeCount'] = 0
+            self.bulkThrottle['lastDecreaseTime'] = 0.0
+            self.bulkThrottle['responseCount'] = 0
+
+        self.logBulkThrottle('reset')
+
+    def getBulkBatchBytes(self):
+        if not self.bulkQueue['adaptive']:
+            return self.bulkQueue['maxQueueBytes']
+
+        return self.bulkThrottle['batchBytes']
+
+    def acquireBulkSlot(self):
+        with self.bulkThrottle['condition']:
+            while self.bulkQueue['adaptive'] and self.bulkThrottle['activeCount'] >= int(self.bulkThrottle['inFlightWindow']):
+                self.bulkThrottle['condition'].wait()
+
+            self.bulkThrottle['activeCount'] = self.bulkThrottle['activeCount'] + 1
+
+        return time.monotonic()
+
+    def releaseBulkSlot(self, startTime, isRejected = False):
+        latency = time.monotonic() - startTime
+
+        with self.bulkThrottle['condition']:
+            self.bulkThrottle['activeCount'] = self.bulkThrottle['activeCount'] - 1
+
+            if self.bulkQueue['adaptive']:
+                self.adjustBulkThrottle(startTime, latency, isRejected)
+
+            self.bulkThrottle['condition'].notify_all()
+
+    def adjustBulkThrottle(self, startTime, latency, isRejected = False):
+        # bulkThrottle['condition'] 을 잡은 상태에서 호출
+        self.bulkThrottle['responseCount'] = self.bulkThrottle['responseCount'] + 1
+
+        if isRejected or latency > self.bulkQueue['targetLatencySeconds']:
+            # 같은 혼잡 구간에서 보낸 요청들의 응답으로 여러 번 줄이지 않도록, 마지막 감소 이후 시작한 요청만 반영
+            if startTime <= self.bulkThrottle['lastDecreaseTime']:
+                return
+
+            factor = self.bulkThrottle['decreaseFactor']
+            operatingPoint = (int(self.bulkThrottle['inFlightWindow']), self.bulkThrottle['batchBytes'])
+            self.bulkThrottle['inFlightWindow'] = max(float(self.bulkQueue['minSenderCount']), self.bulkThrottle['inFlightWindow'] * factor)
+            self.bulkThrottle['batchBytes'] = max(self.bulkQueue['minQueueBytes'], int(self.bulkThrottle['batchBytes'] * factor))
+            self.bulkThrottle['lastDecreaseTime'] = time.monotonic()
+
+            if operatingPoint != (int(self.bulkThrottle['inFlightWindow']), self.bulkThrottle['batchBytes']):
+                self.logBulkThrottle(f'decrease, latency : {latency:.3f}, rejected : {isRejected}')
+            return
+
+        # 동시 요청 수 만큼의 응답이 오면 (RTT 1회) window 1, batch 1 step 증가
+        window = self.bulkThrottle['inFlightWindow']
+        self.bulkThrottle['inFlightWindow'] = min(float(self.bulkQueue['senderCount']), window + 1.0 / window)
+        self.bulkThrottle['batchBytes'] = min(self.bulkQueue['maxQueueBytes'], self.bulkThrottle['batchBytes'] + int(self.bulkThrottle['increaseBatchBytes'] / window))
+
+        if self.bulkThrottle['responseCount'] % self.bulkThrottle['logInterval'] == 0:
+            self.logBulkThrottle('increase')
+
+    def logBulkThrottle(self, reason = ''):
+        if not self.bulkQueue['adaptive']:
+            return
+
+        batchBytes = self.bulkThrottle['batchBytes']
+        inFlight = int(self.bulkThrottle['inFlightWindow'])
+        responseCount = self.bulkThrottle['responseCount']
+        log(f'[bulkThrottle] {reason}, batchBytes : {batchBytes}, inFlight : {inFlight}, responseCount : {responseCount}')
+
+    #######################################################################
+    # function - Elasticsearch
+    #######################################################################
+    def createIndex(self):
+        alias = self.config['alias']
+        indexName = self.config['realIndex']
+
+        indexScheme = {}
+        indexScheme['mappings'] = self.config['indexMappings']['mappings']
+        indexScheme['settings'] = dict(_elasticsearch[self.config['profile']]['indexSettings']['settings'])
+
+        if self.isBulkLoadMode():
+            indexScheme['settings']['refresh_interval'] = '-1'
+            indexScheme['settings']['number_of_replicas'] = 0
+
+        if 'analysis' in self.config['indexAnalysis']:
+            indexScheme['settings']['analysis'] = self.config['indexAnalysis']['analysis']
+
+        if (self.isNotCreateIndex() or alias == indexName):
+            log(json.dumps(indexScheme))
+            return
+
+        if self.isResumedFromCheckpoint():
+            log(f'[createIndex] : resumed from checkpoint, indexName : {indexName}')
+            return
+
+        log(f'[createIndex] : start, indexName : {indexName}')
+
+        url = self.makeElasticsearchUrl(indexName)
+        response = getHttpSession().put(url, data=json.dumps(indexScheme), headers=self.headers, timeout=getHttpTimeout())
+        log(f'[createIndex] {url}, ' + response.text)
+        response.raise_for_status()
+        return response.text
+
+    def restoreIndexSettings(self):
+        if not self.isBulkLoadMode():
+            return ''
+
+        indexName = self.config['realIndex']
+        targetSettings = _elasticsearch[self.config['profile']]['indexSettings']['settings']
+        requestBody = {
+            'index': {
+                'refresh_interval': targetSettings['refresh_interval'],
+                'number_of_replicas': targetSettings['number_of_replicas']
             }
         }
-        requestBody['actions'].append(remove)
 
-    add = {
-        'add': {
-            'alias': alias,
-            'index': indexName
+        log(f'[restoreIndexSettings] : start, indexName : {indexName}, ' + json.dumps(requestBody))
+
+        url = self.makeElasticsearchUrl(f'{indexName}/_settings')
+        response = getHttpSession().put(url, data=json.dumps(requestBody), headers=self.headers, timeout=getHttpTimeout())
+        log(f'[restoreIndexSettings] {url}, ' + response.text)
+        response.raise_for_status()
+
+        url = self.makeElasticsearchUrl(f'{indexName}/_refresh')
+        response = getHttpSession().post(url, headers=self.headers, timeout=getHttpTimeout())
+        log(f'[restoreIndexSettings] {url}, ' + response.text)
+        response.raise_for_status()
+
+        # replica 복제가 끝나 green 이 된 후에 alias 를 교체
+        waitForGreenSeconds = int(self.getConfigValue('bulkLoad', 'waitForGreenSeconds'))
+        url = self.makeElasticsearchUrl(f'_cluster/health/{indexName}?wait_for_status=green&timeout={waitForGreenSeconds}s')
+        response = getHttpSession().get(url, headers=self.headers, timeout=(_http['connectTimeout'], waitForGreenSeconds + _http['readTimeout']))
+        log(f'[restoreIndexSettings] {url}, ' + response.text)
+        response.raise_for_status()
+
+        health = json.loads(response.text)
+        if health['timed_out'] or health['status'] != 'green':
+            raise Exception(f'[restoreIndexSettings] {indexName} is not green : ' + health['status'])
+
+        return response.text
+
+    def forceMergeIndex(self):
+        alias = self.config['alias']
+        indexName = self.config['realIndex']
+        maxNumSegments = int(self.getConfigValue('finalize', 'forceMergeSegments'))
+
+        if (self.isNotCreateIndex() or alias == indexName or maxNumSegments <= 0):
+            return ''
+
+        log(f'[forceMergeIndex] : start, indexName : {indexName}, maxNumSegments : {maxNumSegments}')
+        startTime = time.monotonic()
+
+        # bulk load mode 면 replica 복원 전에 실행되어 primary 만 merge 후 replica 는 merge 된 segment 를 복제
+        timeoutSeconds = int(self.getConfigValue('finalize', 'forceMergeTimeoutSeconds'))
+        url = self.makeElasticsearchUrl(f'{indexName}/_forcemerge?max_num_segments={maxNumSegments}')
+        response = getHttpSession().post(url, headers=self.headers, timeout=(_http['connectTimeout'], timeoutSeconds))
+        response.raise_for_status()
+
+        duration = time.monotonic() - startTime
+        log(f'[forceMergeIndex] {url}, duration : {duration:.3f}s, ' + response.text)
+        return response.text
+
+    def warmUpIndex(self):
+        alias = self.config['alias']
+        indexName = self.config['realIndex']
+        warmupQueries = self.getConfigValue('finalize', 'warmupQueries')
+
+        if (self.isNotCreateIndex() or alias == indexName or len(warmupQueries) == 0):
+            return ''
+
+        log(f'[warmUpIndex] : start, indexName : {indexName}, queries : {len(warmupQueries)}')
+        startTime = time.monotonic()
+
+        url = self.makeElasticsearchUrl(f'{indexName}/_search?request_cache=true')
+        for querySeq in range(len(warmupQueries)):
+            queryStartTime = time.monotonic()
+            response = getHttpSession().post(url, data=json.dumps(warmupQueries[querySeq]), headers=self.headers, timeout=getHttpTimeout())
+            response.raise_for_status()
+
+            took = json.loads(response.text)['took']
+            queryDuration = time.monotonic() - queryStartTime
+            log(f'[warmUpIndex] query : {querySeq}, took : {took}ms, duration : {queryDuration:.3f}s')
+
+        duration = time.monotonic() - startTime
+        log(f'[warmUpIndex] : finish, indexName : {indexName}, duration : {duration:.3f}s')
+        return ''
+
+    def postForBulk(self):
+        if self.isEmptyBulkQueue():
+            return 'bulk queue is empty'
+
+        requestBody = self.makeRequestBodyByBulkQueueAndClear()
+
+        if self.isRunningBulkSenders():
+            self.submitBulkRequest(requestBody)
+            return 'bulk request submitted'
+
+        return self.sendBulkRequest(requestBody)
+
+    def sendBulkRequest(self, requestBody):
+        if (_usable['elasticsearch'] == False):
+            return 'elasticsearch usable : False'
+
+        # 성공한 item 은 status 만 받아 응답 크기를 줄이고, item 순서는 유지
+        url = self.makeElasticsearchUrl('_bulk?filter_path=errors,items.*.status,items.*.error')
+
+        for attempt in range(_bulkRetry['maxRetries'] + 1):
+            isLastAttempt = (attempt == _bulkRetry['maxRetries'])
+            response, result = self.postBulkRequest(url, *self.compressBulkRequest(requestBody))
+
+            if result is None:
+                # _id 를 elasticsearch 가 만들면 502, 503, 504 여도 이미 색인되었을 수 있어 다시 보내면 중복 document, 재시도 대신 dead letter
+                if self.isAutoGenerateId() and response.status_code in _bulkRetry['unknownResultStatus']:
+                    self.addDeadLetterRequest(requestBody, response.status_code)
+                    return 'bulk request failed without retry'
+
+                if not isLastAttempt:
+                    log(f'[sendBulkRequest] status : {response.status_code}, retry : {attempt + 1}')
+                    self.addMetricValue('bulkRetryCount', 1)
+                    sleepBackoff(attempt)
+                    continue
+
+                response.raise_for_status()
+
+            if not result.get('errors', False):
+                return 'bulk request success'
+
+            retryItems = self.splitFailedBulkItems(requestBody, result['items'], isLastAttempt)
+            if len(retryItems) == 0:
+                return 'bulk request finished with failed items'
+
+            self.addRetriedDocumentCount(len(retryItems))
+            self.addMetricValue('bulkRetryCount', 1)
+            log(f'[sendBulkRequest] rejected items : {len(retryItems)}, retry : {attempt + 1}')
+            requestBody = b'\n'.join([line for item in retryItems for line in item]) + b'\n'
+            sleepBackoff(attempt)
+
+    def compressBulkRequest(self, requestBody):
+        # parse 가 아닌 sender thread 에서 압축, 압축 전후 크기를 기록
+        gzipLevel = self.bulkQueue['gzipLevel']
+        if gzipLevel <= 0:
+            return requestBody, self.headers
+
+        import gzip
+        compressedBody = gzip.compress(requestBody, compresslevel=gzipLevel, mtime=0)
+        headers = dict(self.headers)
+        headers['Content-Encoding'] = 'gzip'
+
+        with self.bulkCompression['lock']:
+            self.bulkCompression['batchCount'] = self.bulkCompression['batchCount'] + 1
+            self.bulkCompression['rawBytes'] = self.bulkCompression['rawBytes'] + len(requestBody)
+            self.bulkCompression['compressedBytes'] = self.bulkCompression['compressedBytes'] + len(compressedBody)
+
+        log(f'[compressBulkRequest] rawBytes : {len(requestBody)}, compressedBytes : {len(compressedBody)}')
+        return compressedBody, headers
+
+    def clearBulkCompression(self):
+        with self.bulkCompression['lock']:
+            self.bulkCompression['batchCount'] = 0
+            self.bulkCompression['rawBytes'] = 0
+            self.bulkCompression['compressedBytes'] = 0
+
+    def logBulkCompression(self):
+        if self.bulkCompression['batchCount'] == 0:
+            return
+
+        batchCount = self.bulkCompression['batchCount']
+        rawBytes = self.bulkCompression['rawBytes']
+        compressedBytes = self.bulkCompression['compressedBytes']
+        ratio = compressedBytes / rawBytes
+        log(f'[bulkCompression] batchCount : {batchCount}, rawBytes : {rawBytes}, compressedBytes : {compressedBytes}, ratio : {ratio:.3f}')
+
+    def postBulkRequest(self, url, requestBody, headers = {}):
+        # 응답 latency, reject 여부를 bulk throttle 에 반영, 재시도 대상 status 면 result 는 None
+        startTime = self.acquireBulkSlot()
+        isRejected = True
+
+        try:
+            response = getHttpSession().post(url, data=requestBody, headers=headers, timeout=getHttpTimeout())
+            if response.status_code in _bulkRetry['retryableStatus']:
+                return response, None
+
+            response.raise_for_status()
+            result = response.json()
+            isRejected = result.get('errors', False) and hasRejectedBulkItems(result['items'])
+            return response, result
+        finally:
+            self.addBulkLatencyMetric(time.monotonic() - startTime, len(requestBody))
+            self.releaseBulkSlot(startTime, isRejected)
+
+    def splitFailedBulkItems(self, requestBody, responseItems = [], isLastAttempt = False):
+        # request line 은 document 당 action, source 2줄 (delete 는 action 1줄), 응답 items 와 같은 순서
+        lines = requestBody.split(b'\n')
+        retryItems = []
+        lineSeq = 0
+
+        for responseItem in responseItems:
+            action, result = next(iter(responseItem.items()))
+            lineCount = 1 if action == 'delete' else 2
+            item = tuple(lines[lineSeq:lineSeq + lineCount])
+            lineSeq = lineSeq + lineCount
+
+            if 'error' not in result:
+                continue
+
+            if result['status'] in _bulkRetry['retryableStatus'] and not isLastAttempt:
+                retryItems.append(item)
+            else:
+                self.addDeadLetter(item, result)
+
+        return retryItems
+
+    def addRetriedDocumentCount(self, count = 0):
+        with self.deadLetter['lock']:
+            self.deadLetter['retriedDocumentCount'] = self.deadLetter['retriedDocumentCount'] + count
+
+    def addDeadLetter(self, item, result = {}):
+        with self.deadLetter['lock']:
+            self.deadLetter['items'].append(item)
+            deadLetterCount = len(self.deadLetter['items'])
+
+        if deadLetterCount <= 10:
+            log(f'[addDeadLetter] {item[0].decode("utf-8")}, status : ' + str(result['status']) + ', error : ' + json.dumps(result['error']))
+
+        if deadLetterCount > _bulkRetry['maxDeadLetterDocuments']:
+            raise Exception(f'[addDeadLetter] too many failed documents : {deadLetterCount}')
+
+    def addDeadLetterRequest(self, requestBody, status = 0):
+        # 요청 전체가 실패한 경우, autoGenerateId 는 index action 만 있으므로 document 당 2줄
+        lines = requestBody.split(b'\n')
+        result = {'status': status, 'error': 'bulk request failed, not retried to avoid duplicate documents'}
+        for lineSeq in range(0, len(lines) - 1, 2):
+            self.addDeadLetter((lines[lineSeq], lines[lineSeq + 1]), result)
+
+    def clearDeadLetter(self):
+        with self.deadLetter['lock']:
+            self.deadLetter['items'] = []
+            self.deadLetter['retriedDocumentCount'] = 0
+
+    def makeDeadLetterS3Key(self):
+        # checkpoint 에서 이어서 색인한 경우 이전 invocation 의 dead letter 를 덮어쓰지 않도록 시작 offset 을 붙임
+        offsetSuffix = ''
+        if self.checkpoint['startOffset'] > 0:
+            offsetSuffix = '.' + str(self.checkpoint['startOffset'])
+
+        return self.config['root'] + _deadLetterPath + '/' + self.config['profile'] + '.' + self.config['realIndex'] + '.' + self.config['action'] + '.' + self.config['dataTime'] + offsetSuffix + '.ndjson'
+
+    def putDeadLetterObject(self):
+        deadLetterCount = len(self.deadLetter['items'])
+        retriedDocumentCount = self.deadLetter['retriedDocumentCount']
+        log(f'[putDeadLetterObject] retriedDocumentCount : {retriedDocumentCount}, deadLetterCount : {deadLetterCount}')
+
+        if (deadLetterCount == 0 or _usable['s3'] == False):
+            return ''
+
+        # dead letter 파일은 그대로 _bulk 에 다시 보낼 수 있는 ndjson
+        key = self.makeDeadLetterS3Key()
+        body = b'\n'.join([line for item in self.deadLetter['items'] for line in item]) + b'\n'
+        getS3Client().put_object(Bucket=self.config['s3Bucket'], Key=key, Body=body)
+
+        self.sendMessage('error', f'데이터 {deadLetterCount}건의 색인이 실패하였습니다.\n' + self.config['s3Bucket'] + ':' + key)
+        return key
+
+    def bulk(self):
+        indexName = self.config['realIndex']
+        log(f'[bulk] : start, indexName : {indexName}')
+
+        if (_usable['s3'] == False):
+            return
+
+        if self.isBulkFinishedByCheckpoint():
+            log(f'[bulk] : finished by checkpoint, indexName : {indexName}')
+            return
+
+        byteOffset = self.checkpoint['startOffset']
+        recordCount = self.checkpoint['startRecordCount']
+
+        s3Stream = self.openS3ObjectStream(byteOffset, self.fanOut['rangeEnd'])
+
+        self.clearDeadLetter()
+        self.clearBulkCompression()
+        self.resetBulkThrottle()
+        self.startBulkSenders()
+
+        # checkpoint, fan out worker 는 header 를 이미 알고 있음
+        if recordCount >= 1:
+            self.compileBulkConverter()
+
+        position = makeStreamPosition(byteOffset)
+        skippedRowCount = 0
+
+        try:
+            for fields in self.readS3ObjectRecords(s3Stream, position):
+                recordCount = recordCount + 1
+
+                if (recordCount == 1):
+                    self.headerValidate(fields)
+                    setValue(self.config, 'indexFieldNames', fields)
+                    self.compileBulkConverter()
+                else:
+                    if self.isDedupSkippedRow(recordCount) or self.isDeltaSkippedRow(recordCount):
+                        skippedRowCount = skippedRowCount + 1
+                        continue
+
+                    self.makeBulkJsonAndAddQueue(fields)
+
+                    if self.isFullBulkQueue():
+                        self.postForBulk()
+
+                        if self.isFanOutWorker():
+                            continue
+
+                        if self.isCheckpointTime() or self.isHandoffTime():
+                            self.checkpointBulk(getStreamByteOffset(position), recordCount)
+
+                            if self.isHandedOff():
+                                s3Stream.close()
+                                return
+
+            self.postForBulk()
+            self.stopBulkSenders()
+            if not self.isFanOutWorker():
+                self.putCheckpoint('bulkFinished', getStreamByteOffset(position), recordCount)
+        finally:
+            # 전송 중인 batch 가 모두 끝난 후 다음 단계(rebindAlias) 진행
+            self.stopBulkSenders()
+            self.logBulkThrottle('finish')
+            self.logBulkCompression()
+            self.putDeadLetterObject()
+            self.addMetricValue('retriedDocumentCount', self.deadLetter['retriedDocumentCount'])
+            self.addMetricValue('deadLetterCount', len(self.deadLetter['items']))
+            # 건너뛴 row 는 보내지 않았으므로 DocumentsPerSecond 에서 빠지도록 제외
+            self.addMetricValue('documentCount', recordCount - max(self.checkpoint['startRecordCount'], 1) - skippedRowCount)
+
+        # 두 bitmap 모두 건너뛴 row 는 dedup 으로 집계 (delta 의 changedRows 는 dedup 에서 남은 row 중에서만 표시)
+        skippedCounts = {}
+        indexedCount = recordCount - 1
+        if self.dedup['keptRows'] is not None:
+            skippedCounts['dedup'] = indexedCount - countRowBits(self.dedup['keptRows'])
+            indexedCount = indexedCount - skippedCounts['dedup']
+        if self.delta['changedRows'] is not None:
+            skippedCounts['delta'] = indexedCount - countRowBits(self.delta['changedRows'])
+            indexedCount = indexedCount - skippedCounts['delta']
+
+        skippedMessages = {'dedup': '중복 _id', 'delta': '변경 없음'}
+        message = '데이터 ' + str(indexedCount) + '건이 등록되었습니다.'
+        for name, skippedCount in skippedCounts.items():
+            log(f'[bulk] : {name} skipped : {skippedCount}')
+            self.setMetricValue(name + 'SkippedCount', skippedCount)
+            message = message + f' ({skippedMessages[name]} {skippedCount}건 제외)'
+
+        self.sendMessage('count', message)
+        return recordCount - 1
+
+    def getAliasBindedIndex(self):
+        if (_usable['elasticsearch'] == False):
+            return ''
+
+        alias = self.config['alias']
+
+        url = self.makeElasticsearchUrl(f'_cat/aliases/{alias}?format=json')
+        response = getHttpSession().get(url, headers=self.headers, timeout=getHttpTimeout())
+        log(f'[getAliasBindedIndex] {url}, ' + response.text)
+        response.raise_for_status()
+
+        bindedIndices = json.loads(response.text)
+
+        if (len(bindedIndices) > 1):
+            raise Exception(f'{alias} is multi indices binded')
+        elif (len(bindedIndices) == 0):
+            return ''
+
+        return bindedIndices[0]['index']
+
+    def setNotDeleteIndicies(self, indices = []):
+        setValue(self.config, 'notDeleteIndicies', indices)
+
+    def rebindAlias(self):
+        alias = self.config['alias']
+        indexName = self.config['realIndex']
+        bindedIndexName = self.getAliasBindedIndex()
+
+        if (self.isNotCreateIndex() or alias == indexName):
+            return ''
+
+        # checkpoint 로 재실행된 경우 alias 교체는 한 번만
+        if (bindedIndexName == indexName):
+            log(f'[rebindAlias] : already binded, alias : {alias}, indexName : {indexName}')
+            return ''
+
+        self.setNotDeleteIndicies([indexName, bindedIndexName])
+
+        log(f'[rebindAlias] : start, alias : {alias}, bindedIndexName : {bindedIndexName}, indexName : {indexName}, ')
+
+        requestBody = {
+            'actions': []
         }
-    }
 
-    requestBody['actions'].append(add)
+        if (bindedIndexName != ''):
+            remove = {
+                'remove': {
+                    'alias': alias,
+                    'index': bindedIndexName
+                }
+            }
+            requestBody['actions'].append(remove)
 
-    log('rebindAlias ' + json.dumps(requestBody))
+        add = {
+            'add': {
+                'alias': alias,
+                'index': indexName
+            }
+        }
 
-    url = makeElasticsearchUrl('_aliases')
-    response = requests.post(url, data=json.dumps(requestBody), headers=_elasticsearch['headers'])
-    log(f'[rebindAlias] {url}, ' + response.text)
-    response.raise_for_status()
-    return response.text
+        requestBody['actions'].append(add)
 
-def deleteOldIndcies():
-    alias = _config['alias']
-    notDeleteIndicies = _config['notDeleteIndicies']
-    notDeleteIndiciesCount = 0
+        log('rebindAlias ' + json.dumps(requestBody))
 
-    for index in notDeleteIndicies:
-        if (index != ''):
-            notDeleteIndiciesCount = notDeleteIndiciesCount + 1
+        url = self.makeElasticsearchUrl('_aliases')
+        response = getHttpSession().post(url, data=json.dumps(requestBody), headers=self.headers, timeout=getHttpTimeout())
+        log(f'[rebindAlias] {url}, ' + response.text)
+        response.raise_for_status()
+        return response.text
 
-    if (isNotCreateIndex() or notDeleteIndiciesCount == 0):
-        return
+    def deleteOldIndcies(self):
+        alias = self.config['alias']
+        notDeleteIndicies = self.config['notDeleteIndicies']
+        notDeleteIndiciesCount = 0
 
-    url = makeElasticsearchUrl(f'_cat/indices/{alias}-20*?format=json')
-    response = requests.get(url, headers=_elasticsearch['headers'])
-    log(f'[deleteOldIndicies] indicies {url}: ' + response.text)
-    response.raise_for_status()
+        for index in notDeleteIndicies:
+            if (index != ''):
+                notDeleteIndiciesCount = notDeleteIndiciesCount + 1
 
-    indicies = json.loads(response.text)
+        if (self.isNotCreateIndex() or notDeleteIndiciesCount == 0):
+            return
 
-    if (len(indicies) == 0):
-        return
+        url = self.makeElasticsearchUrl(f'_cat/indices/{alias}-20*?format=json')
+        response = getHttpSession().get(url, headers=self.headers, timeout=getHttpTimeout())
+        log(f'[deleteOldIndicies] indicies {url}: ' + response.text)
+        response.raise_for_status()
 
-    deleteIndicies = [index['index'] for index in indicies if index['index'] not in notDeleteIndicies]
+        indicies = json.loads(response.text)
 
-    if (len(deleteIndicies) == 0):
-        return
+        if (len(indicies) == 0):
+            return
 
-    url = makeElasticsearchUrl(','.join(deleteIndicies))
-    response = requests.delete(url, headers=_elasticsearch['headers'])
-    log(f'[deleteOldIndicies] delete idicies : {url}, ' + response.text)
-    response.raise_for_status()
-    return response.text
+        deleteIndicies = [index['index'] for index in indicies if index['index'] not in notDeleteIndicies]
 
-def moveS3Object():
-    if (_usable['s3'] == False):
-        return
+        if (len(deleteIndicies) == 0):
+            return
 
-    key = _config['root'] + _backupPath + '/' + _config['profile'] + '.' + _config['realIndex'] + '.' + _config['action'] + '.csv'
+        url = self.makeElasticsearchUrl(','.join(deleteIndicies))
+        response = getHttpSession().delete(url, headers=self.headers, timeout=getHttpTimeout())
+        log(f'[deleteOldIndicies] delete idicies : {url}, ' + response.text)
+        response.raise_for_status()
+        return response.text
 
-    _s3Client.copy_object(
-        Bucket=_config['s3Bucket'],
-        Key=key,
-        CopySource={'Bucket': _config['s3Bucket'], 'Key': _config['s3Key']},
-    )
+    def moveS3Object(self):
+        if (_usable['s3'] == False):
+            return
+
+        key = self.config['root'] + _backupPath + '/' + self.config['profile'] + '.' + self.config['realIndex'] + '.' + self.config['action'] + '.csv'
+        if self.isCompressedFile():
+            key = key + '.' + self.config['fileCompression']
+
+        getS3Client().copy_object(
+            Bucket=self.config['s3Bucket'],
+            Key=key,
+            CopySource={'Bucket': self.config['s3Bucket'], 'Key': self.config['s3Key']},
+        )
 
-    _s3Client.delete_object(Bucket=_config['s3Bucket'], Key=_config['s3Key'])
+        getS3Client().delete_object(Bucket=self.config['s3Bucket'], Key=self.config['s3Key'])
 
-    log(f'[moveS3Object] delete s3Object : ' + _config['s3Key'])
+        log(f'[moveS3Object] delete s3Object : ' + self.config['s3Key'])
 
-    return '';
\ No newline at end of file
+        return '';
@@ -1,2 +1,5 @@
 #!/bin/sh
-python3 lambda_function.py 
\ No newline at end of file
+# AWS, Elasticsearch 없이 local S3 대역과 fake Elasticsearch 로 전체 pipeline 실행 (bench/bench_pipeline.py)
+# delta, dedup merge 결과 확인 (bench/check_delta.py)
+python3 ../bench/check_delta.py || exit 1
+python3 ../bench/bench_pipeline.py --scale 0.1 "$@"